@@ -1,8 +1,9 @@
 """ Banking Model Functions """
 from statistics import mean
-import random
 import math
-import numpy as np
+import loan_book as lb
+import withdrawal_engine as we
+import random_streams as rs
 
 
 def set_initial_deposits(model):
@@ -17,8 +18,9 @@ def allocate_budget(model):
     The minimum budget is 350 and normalized to average 1000
     """
     household_budgets = []
+    budgets = rs.numpy_stream(model, "budget")
     for household in model.households:
-        household.budget = 350 + np.random.exponential(1000-350)
+        household.budget = 350 + budgets.exponential(1000-350)
         household_budgets.append(household.budget)
 
     household_budgets_mean = round(mean(household_budgets), 3)
@@ -30,7 +32,7 @@ def allocate_budget(model):
 
 def determine_savers(model):
     """ Determines which households are savers """
-    savers = random.sample(model.households, model.num_savers)
+    savers = rs.python_stream(model, "savers").sample(model.households, model.num_savers)
 
     for saver in savers:
         saver.own_total_savings = 10
@@ -68,7 +70,8 @@ def collect_debts(model):
         num_borrowers = len(borrowers)
         model.num_defaulters = round(
             (model.defaulters_percent / 100) * num_borrowers)
-        defaulters = random.sample(borrowers, model.num_defaulters)
+        defaulters = rs.python_stream(model, "defaulters").sample(
+            borrowers, model.num_defaulters)
         defaulter_outstanding_borrowing = []
         for defaulter in defaulters:
             defaulter.defaulter = "Yes"
@@ -82,17 +85,23 @@ def collect_debts(model):
 
         for defaulter in defaulters:
             defaulter.own_outstanding_borrowing = 0
+        if model.loan_book is not None:
+            model.loan_book.write_off([defaulter.unique_id for defaulter in defaulters])
 
-    non_defaulters = [
-        household for household in model.households if household.own_outstanding_borrowing > 0
-        and household.defaulter == "No"]
-    for non_defaulter in non_defaulters:
-        non_defaulter.borrowers_interest_payment = round(
-            non_defaulter.own_outstanding_borrowing * model.monthly_loan_rate, 3)
-        non_defaulter.capital_repayment = round(
-            non_defaulter.monthly_repayment - non_defaulter.borrowers_interest_payment, 3)
-        non_defaulter.own_outstanding_borrowing = round(
-            non_defaulter.own_outstanding_borrowing - non_defaulter.capital_repayment, 3)
+    if model.loan_book is not None:
+        # Mixed portfolios repay every loan in the loan book at its own rate
+        model.loan_book.collect_repayments(model)
+    else:
+        non_defaulters = [
+            household for household in model.households
+            if household.own_outstanding_borrowing > 0 and household.defaulter == "No"]
+        for non_defaulter in non_defaulters:
+            non_defaulter.borrowers_interest_payment = round(
+                non_defaulter.own_outstanding_borrowing * model.monthly_loan_rate, 3)
+            non_defaulter.capital_repayment = round(
+                non_defaulter.monthly_repayment - non_defaulter.borrowers_interest_payment, 3)
+            non_defaulter.own_outstanding_borrowing = round(
+                non_defaulter.own_outstanding_borrowing - non_defaulter.capital_repayment, 3)
 
     for household in model.households:
         household.own_expenditure_this_month = round(
@@ -182,6 +191,8 @@ def make_withdrawals(model):
     runners = [
         household for household in model.households if household.adoption == "yes"
         and household.own_total_savings > 0]
+    amounts = [runner.own_total_savings for runner in runners]
+    liquid_assets = model.total_banks_required_liquidity + model.banks_spare_cash
     for runner in runners:
         model.amount_withdrawn += runner.own_total_savings
         runner.own_total_savings = 0
@@ -207,6 +218,16 @@ def make_withdrawals(model):
         model.liquidity_event = 1
         model.liquidity_event_month = model.month_counter
 
+    # Day and household at which liquidity ran out within the month
+    if model.intra_month_withdrawals:
+        times = we.arrival_times(rs.numpy_stream(model, "withdrawals"), len(amounts))
+        position, day, model.liquidity_path = we.drain(amounts, times, liquid_assets)
+        model.liquidity_paths.append(model.liquidity_path)
+        model.liquidity_path_months.append(model.month_counter)
+        if model.liquidity_event and position >= 0:
+            model.liquidity_event_day = day
+            model.liquidity_event_household = runners[position].unique_id
+
 
 def make_loans(model):
     """ Banks decide how much to lend """
@@ -252,8 +273,11 @@ def make_loans(model):
             model.car_constraint_indicator = 1
             model.max_rwa = (model.total_capital + model.total_retained_profit) / \
                 (model.target_capital_adequacy_ratio_percent / 100)
-            model.max_lending_allowed = model.max_rwa / \
-                (model.risk_weight_loan_percent / 100)
+            if model.loan_book is not None:
+                model.max_lending_allowed = model.loan_book.lending_allowed(model.max_rwa)
+            else:
+                model.max_lending_allowed = model.max_rwa / \
+                    (model.risk_weight_loan_percent / 100)
             model.new_loans_available = round(
                 model.max_lending_allowed - model.total_lending_at_start_of_month)
 
@@ -262,6 +286,16 @@ def make_loans(model):
         model.new_loans_available = 0
         model.num_loans = 0
 
+    model.loan_market.clear()
+
+    # Mixed portfolios split the funds between the products in the loan book
+    if model.loan_book is not None:
+        lb.make_loans(model)
+        model.banks_spare_cash = model.new_loan_supply - model.total_new_loans
+        if model.banks_spare_cash < 0:
+            model.loan_error = "Yes"
+        return
+
     # Loan size depends on type of loan
     if model.new_loans_available < model.loan_size:
         model.new_loans_available = 0
@@ -285,18 +319,10 @@ def make_loans(model):
     # Only one loan each
     # Monthly cost is set in setup and is same for all borrowers
 
-    # Applies affordability test
-    if model.affordability_test:
-        household_potential_borrowers = [
-            household for household in model.households if household.own_outstanding_borrowing == 0
-            and (0.5 * household.budget) >= model.monthly_cost]
-        for potential_borrower in household_potential_borrowers:
-            potential_borrower.potential_borrower = "Yes"
-    else:
-        household_potential_borrowers = [
-            household for household in model.households if household.own_outstanding_borrowing == 0]
-        for potential_borrower in household_potential_borrowers:
-            potential_borrower.potential_borrower = "Yes"
+    # Affordability test is applied by the loan market
+    household_potential_borrowers = model.loan_market.potential_borrowers()
+    for potential_borrower in household_potential_borrowers:
+        potential_borrower.potential_borrower = "Yes"
 
     model.potential_borrowers = len(household_potential_borrowers)
 
@@ -312,11 +338,8 @@ def make_loans(model):
 
     # Households take loans
     new_loans = []
-    household_potential_loan_takers = [
-        household for household in model.households if household.own_outstanding_borrowing == 0
-        and household.potential_borrower == "Yes"]
-    household_loan_takers = random.sample(
-        household_potential_loan_takers, model.num_new_borrowers)
+    household_loan_takers = model.loan_market.draw_borrowers(
+        household_potential_borrowers, model.num_new_borrowers, model.loan_size)
     for household_loan_taker in household_loan_takers:
         # own_loan is the original loan that does not change
         household_loan_taker.own_loan = model.loan_size
@@ -337,13 +360,11 @@ def make_loans(model):
 
 def spend_loans(model):
     """ Spend loans """
-    # Identifies only those becoming borrowers this month; if used own_loan, would
+    # Only those becoming borrowers this month; if used own_loan, would
     # include all borrowers
-    new_loan_households = [
-        household for household in model.households if household.new_loan == "Yes"]
-    for new_loan_household in new_loan_households:
-        seller = random.sample(model.households, 1)
-        seller[0].spent_loan = new_loan_household.own_loan
+    sellers = model.loan_market.draw_sellers()
+    for loan, seller in zip(model.loan_market.loans, sellers):
+        seller.spent_loan = loan
 
 
 def collect_data_at_end_of_month(model):
@@ -403,8 +424,11 @@ def collect_data_at_end_of_month(model):
     # Capital Adequacy Ratio
     # Risk weight allocated in set-up
     for bank in model.banks:
-        bank.risk_weighted_exposure = model.total_lending_at_end_of_month * \
-            model.risk_weight_loan_percent / 100
+        if model.loan_book is not None:
+            bank.risk_weighted_exposure = model.loan_book.risk_weighted_exposure()
+        else:
+            bank.risk_weighted_exposure = model.total_lending_at_end_of_month * \
+                model.risk_weight_loan_percent / 100
 
     risk_weighted_exposure = []
     for bank in model.banks:
@@ -0,0 +1,669 @@
+""" Ensemble Model Functions
+
+Array versions of the banking and threshold model functions. Household state
+is shaped (replicates, households) and bank state is shaped (replicates,), so
+each phase runs as one array operation across all replicates.
+"""
+import numpy as np
+import neighbor_kernels as nk
+import network_topology as nt
+import population_scaling as ps
+import loan_market as lm
+import withdrawal_engine as we
+import random_streams as rs
+
+# Household status codes
+STATUS_NONE = 0
+STATUS_INNOVATOR = 1
+
+# Moves for social shifting, indexed by the direction drawn from 1 to 8
+MOVE_X = np.array([0, -1, 0, 1, 1, 1, 0, -1, -1])
+MOVE_Y = np.array([0, 1, 1, 1, 0, -1, -1, -1, 0])
+
+
+def sample_mask(rng, eligible, counts):
+    """
+    Selects counts[r] eligible households at random, without replacement,
+    in each replicate r
+    """
+    keys = np.where(eligible, rng.random(eligible.shape), 2.0)
+    order = np.argsort(keys, axis=1)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.broadcast_to(
+        np.arange(eligible.shape[1]), order.shape), axis=1)
+    return (ranks < np.asarray(counts)[:, None]) & eligible
+
+
+def count_neighbors(model, flags, include_center):
+    """
+    Counts the flagged neighbors of every household in every replicate
+    include_center also counts neighbors at exactly the same position
+    """
+    if not model.circles:
+        return np.zeros(flags.shape, dtype=int)
+
+    num_households = model.num_households
+    rows = []
+    cols = []
+    for replicate, (indptr, indices, far) in enumerate(model.circles):
+        offset = replicate * num_households
+        replicate_rows = nk.edge_rows(indptr)
+        if not include_center:
+            replicate_rows = replicate_rows[far]
+            indices = indices[far]
+        rows.append(replicate_rows + offset)
+        cols.append(indices + offset)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    counts = np.bincount(rows, weights=flags.ravel()[cols],
+                         minlength=flags.size)
+    return counts.reshape(flags.shape).astype(int)
+
+
+def set_initial_deposits(model):
+    """ Sets the total initial deposits """
+    model.total_initial_deposits = model.total_initial_deposits + \
+        model.initial_deposits
+
+
+def allocate_budget(model):
+    """
+    Allocates a budget to each household
+    The minimum budget is 350 and normalized to average 1000
+    """
+    household_budgets = 350 + rs.numpy_stream(model, "budget").exponential(
+        1000-350, size=model.households_shape)
+    household_budgets_mean = np.round(household_budgets.mean(axis=1), 3)
+    model.budget = np.round(
+        (household_budgets * (1000 / household_budgets_mean[:, None])) / 1000, 3)
+    model.affordable = lm.affordable_households(model.budget, model.monthly_cost)
+
+
+def determine_savers(model):
+    """ Determines which households are savers """
+    savers = sample_mask(rs.numpy_stream(model, "savers"),
+                         np.ones(model.households_shape, dtype=bool),
+                         np.full(model.num_replicates, model.num_savers))
+    model.own_total_savings = np.where(savers, 10.0, model.own_total_savings)
+
+
+def use_population(model):
+    """
+    Takes budgets, savers and social circles from a precomputed population
+    shared by every replicate
+    """
+    model.budget = np.broadcast_to(
+        model.population["budget"], model.households_shape)
+    model.affordable = np.broadcast_to(lm.affordable_households(
+        model.population["budget"], model.monthly_cost), model.households_shape)
+    model.own_total_savings = np.where(
+        model.population["savers"], 10.0, model.own_total_savings)
+    if model.bank_run:
+        circles = (model.population["indptr"], model.population["indices"],
+                   model.population["far"])
+        model.circles = [circles] * model.num_replicates
+
+
+def month_reset(model):
+    """ Resets variables at the beginning of the month """
+    model.month_counter = model.month_counter + 1
+    model.max_lending_allowed = np.zeros(model.num_replicates)
+    model.new_loan_supply = np.zeros(model.num_replicates)
+    model.total_current_profit = np.zeros(model.num_replicates)
+    model.total_expenditure = np.zeros(model.num_replicates)
+    model.car_constraint_indicator = np.zeros(model.num_replicates, dtype=int)
+
+    model.potential_borrower = np.zeros(model.households_shape, dtype=bool)
+    model.own_expenditure_this_month = np.zeros(model.households_shape)
+    model.new_loan = np.zeros(model.households_shape, dtype=bool)
+
+
+def collect_debts(model):
+    """
+    Banks collect regular repayments from borrowers
+    This does not run in the first month
+    """
+    # If shock switched on then chosen per cent of borrowers default at chosen month
+    if model.shock:
+        shocked = model.month_counter == model.shock_month
+    else:
+        shocked = np.zeros(model.num_replicates, dtype=bool)
+
+    if shocked.any():
+        borrowers = (model.own_outstanding_borrowing > 0) & shocked[:, None]
+        num_borrowers = borrowers.sum(axis=1)
+        model.num_defaulters = np.where(shocked, np.round(
+            (model.defaulters_percent / 100) * num_borrowers), model.num_defaulters).astype(int)
+        defaulters = sample_mask(rs.numpy_stream(model, "defaulters"), borrowers,
+                                 np.where(shocked, model.num_defaulters, 0))
+        model.defaulter = model.defaulter | defaulters
+        model.monthly_repayment = np.where(
+            defaulters, 0, model.monthly_repayment)
+        model.borrowers_interest_payment = np.where(
+            defaulters, 0, model.borrowers_interest_payment)
+        model.capital_repayment = np.where(
+            defaulters, 0, model.capital_repayment)
+        model.total_bad_debts = np.where(shocked, np.round(
+            np.where(defaulters, model.own_outstanding_borrowing, 0).sum(axis=1)),
+            model.total_bad_debts)
+        model.own_outstanding_borrowing = np.where(
+            defaulters, 0, model.own_outstanding_borrowing)
+
+    non_defaulters = (model.own_outstanding_borrowing > 0) & ~model.defaulter
+    model.borrowers_interest_payment = np.where(non_defaulters, np.round(
+        model.own_outstanding_borrowing * model.monthly_loan_rate, 3),
+        model.borrowers_interest_payment)
+    model.capital_repayment = np.where(non_defaulters, np.round(
+        model.monthly_repayment - model.borrowers_interest_payment, 3),
+        model.capital_repayment)
+    model.own_outstanding_borrowing = np.where(non_defaulters, np.round(
+        model.own_outstanding_borrowing - model.capital_repayment, 3),
+        model.own_outstanding_borrowing)
+
+    model.own_expenditure_this_month = np.round(
+        model.budget - model.monthly_repayment, 3)
+
+    # For households that have paid off all of their debt
+    non_borrowers = model.own_outstanding_borrowing <= 0
+    model.own_outstanding_borrowing = np.where(
+        non_borrowers, 0, model.own_outstanding_borrowing)
+    model.own_loan = np.where(non_borrowers, 0, model.own_loan)
+    model.monthly_repayment = np.where(
+        non_borrowers, 0, model.monthly_repayment)
+    model.capital_repayment = np.where(
+        non_borrowers, 0, model.capital_repayment)
+    model.borrowers_interest_payment = np.where(
+        non_borrowers, 0, model.borrowers_interest_payment)
+
+    model.total_repayments = np.round(model.monthly_repayment.sum(axis=1))
+    model.total_capital_repayments = np.round(
+        model.capital_repayment.sum(axis=1))
+    model.total_borrowers_interest_payments = np.round(
+        model.borrowers_interest_payment.sum(axis=1))
+
+
+def pay_interest_to_savers(model):
+    """
+    Banks pay interest to savers and savers leave interest in accounts
+    Does not run in first month - as paid in arrears
+    """
+    model.monthly_savers_rate = round(
+        model.annual_savers_rate_percent / (12 * 100), 6)
+
+    savers = model.own_total_savings > 0
+    model.savers_interest_payment = np.where(savers, np.round(
+        model.own_total_savings * model.monthly_savers_rate, 6),
+        model.savers_interest_payment)
+    model.own_total_savings = np.where(
+        savers, model.own_total_savings + model.savers_interest_payment,
+        model.own_total_savings)
+
+    model.total_savers_interest_payments = np.round(
+        model.savers_interest_payment.sum(axis=1))
+
+
+def collect_interest_on_liquid_assets(model):
+    """
+    Banks
+    Does not run in first month - as paid in arrears
+    """
+    model.income_on_liquid_assets = np.round(
+        model.total_banks_liquidity * model.monthly_savers_rate)
+
+
+def make_deposits(model):
+    """
+    Does not run in first month as initial savings set
+    spent_loans are generated by payments in the last round
+    households only
+    """
+    sellers = model.spent_loan > 0
+    model.own_total_savings = np.where(
+        sellers, model.own_total_savings + model.spent_loan, model.own_total_savings)
+    model.spent_loan = np.where(sellers, 0, model.spent_loan)
+
+
+def make_withdrawals(model):
+    """
+    Does not run in first month
+    Adopters withdraw funds from bank
+    """
+    runners = model.adoption & (model.own_total_savings > 0)
+    amounts = np.where(runners, model.own_total_savings, 0)
+    liquid_assets = model.total_banks_required_liquidity + model.banks_spare_cash
+    model.amount_withdrawn = amounts.sum(axis=1)
+    model.own_total_savings = np.where(runners, 0, model.own_total_savings)
+    model.spent_loan = np.where(runners, 0, model.spent_loan)
+
+    # Funds must come from either bank's spare cash or bank's required liquidity
+    # Funds come from spare cash reserve first, then required liquidity
+    liquidity_buffer = model.banks_spare_cash - model.amount_withdrawn
+    covered = liquidity_buffer >= 0
+    model.banks_spare_cash = np.where(covered, liquidity_buffer, 0)
+    model.total_banks_required_liquidity = np.where(
+        covered, model.total_banks_required_liquidity,
+        model.total_banks_required_liquidity + liquidity_buffer)
+
+    # Liquidity event check
+    model.bank_liquid_assets = np.round(
+        model.total_banks_required_liquidity + model.banks_spare_cash, 1)
+    event = model.bank_liquid_assets < 0
+    model.liquidity_event = np.where(event, 1, model.liquidity_event)
+    model.liquidity_event_month = np.where(
+        event, model.month_counter, model.liquidity_event_month)
+
+    # Day and household at which liquidity ran out within the month
+    if model.intra_month_withdrawals:
+        times = np.where(runners, we.arrival_times(
+            rs.numpy_stream(model, "withdrawals"), runners.shape), np.inf)
+        position, day, model.liquidity_path = we.drain(amounts, times, liquid_assets)
+        event &= position >= 0
+        model.liquidity_event_day = np.where(event, day, model.liquidity_event_day)
+        model.liquidity_event_household = np.where(
+            event, position, model.liquidity_event_household)
+
+
+def make_loans(model):
+    """ Banks decide how much to lend """
+    # Put aside funds to meet liquidity ratio
+    model.total_deposits_at_start_of_month = model.own_total_savings.sum(axis=1)
+    model.total_banks_required_liquidity = np.round(
+        (model.total_deposits_at_start_of_month * model.target_reserve_ratio_percent) / 100)
+
+    # Looks at how much lent
+    # Takes repayments into account
+    model.total_lending_at_start_of_month = np.round(
+        model.own_outstanding_borrowing.sum(axis=1))
+
+    # Calculate amount available for new loans
+    model.total_capital = model.capital
+    model.overall_balance_at_start_of_month = model.overall_balance_at_end_of_month
+
+    # Includes spare cash by definition
+    model.new_loan_supply = np.maximum(0, np.round(
+        model.total_deposits_at_start_of_month - model.total_banks_required_liquidity -
+        model.total_lending_at_start_of_month))
+
+    # Check against capital adequacy ratio calculated at end of last month
+    # - so can't be calculated for first month
+    unconstrained = (model.month_counter == 1) | (
+        model.capital_adequacy_ratio_percent >= model.target_capital_adequacy_ratio_percent)
+    model.car_constraint_indicator = np.where(
+        unconstrained, model.car_constraint_indicator, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        max_rwa = (model.total_capital + model.total_retained_profit) / \
+            (model.target_capital_adequacy_ratio_percent / 100)
+        max_lending_allowed = max_rwa / (model.risk_weight_loan_percent / 100)
+    model.max_rwa = np.where(unconstrained, model.max_rwa, max_rwa)
+    model.max_lending_allowed = np.where(
+        unconstrained, model.max_lending_allowed, max_lending_allowed)
+    model.new_loans_available = np.where(unconstrained, model.new_loan_supply, np.round(
+        model.max_lending_allowed - model.total_lending_at_start_of_month))
+
+    # Check if new_loans_available is enough to make loans
+    # Loan size depends on type of loan
+    model.new_loans_available = np.where(
+        model.new_loans_available < model.loan_size, 0, model.new_loans_available)
+
+    # Rounding
+    model.num_loans = np.floor(
+        model.new_loans_available / model.loan_size).astype(int)
+    model.new_loans_available = np.where(
+        model.num_loans > 0, model.num_loans * model.loan_size, model.new_loans_available)
+
+    # No lending
+    model.month_loans_stop = np.where(
+        (model.num_loans == 0) & (model.month_loans_stop == 0),
+        model.month_counter, model.month_loans_stop)
+
+    # Only one loan each
+    # Monthly cost is set in setup and is same for all borrowers
+
+    # Applies affordability test, precomputed from the fixed budgets
+    household_potential_borrowers = model.own_outstanding_borrowing == 0
+    if model.affordability_test:
+        household_potential_borrowers &= model.affordable
+    model.potential_borrower = model.potential_borrower | household_potential_borrowers
+    model.potential_borrowers = household_potential_borrowers.sum(axis=1)
+
+    # Number of borrowers determined by supply of loan funds or eligibility
+    model.num_new_borrowers = np.minimum(
+        model.num_loans, model.potential_borrowers)
+
+    # Households take loans
+    household_loan_takers = sample_mask(rs.numpy_stream(model, "borrowers"),
+                                        household_potential_borrowers, model.num_new_borrowers)
+    # own_loan is the original loan that does not change
+    model.own_loan = np.where(
+        household_loan_takers, model.loan_size, model.own_loan)
+    # starts off as the same as own_loan but is reduced by capital repayments
+    model.own_outstanding_borrowing = np.where(
+        household_loan_takers, model.own_loan, model.own_outstanding_borrowing)
+    # Monthly cost fixed in setup - same for all borrowers
+    model.monthly_repayment = np.where(
+        household_loan_takers, model.monthly_cost, model.monthly_repayment)
+    model.new_loan = model.new_loan | household_loan_takers
+
+    model.total_new_loans = model.num_new_borrowers * model.loan_size
+
+    # Banks spare cash is not cumulative
+    model.banks_spare_cash = model.new_loan_supply - model.total_new_loans
+    model.loan_error = model.loan_error | (model.banks_spare_cash < 0)
+
+
+def spend_loans(model):
+    """ Spend loans """
+    # Each new loan is spent with one seller drawn at random from all households
+    num_new_loans = model.new_loan.sum(axis=1)
+    if num_new_loans.max(initial=0) == 0:
+        return
+    sellers = rs.row_integers(rs.numpy_stream(model, "sellers"),
+                              0, model.num_households, num_new_loans)
+    spending = np.arange(sellers.shape[1]) < num_new_loans[:, None]
+    replicates = np.broadcast_to(
+        np.arange(model.num_replicates)[:, None], sellers.shape)
+    model.spent_loan[replicates[spending], sellers[spending]] = model.loan_size
+
+
+def collect_data_at_end_of_month(model):
+    """ Households borrow, banks lend
+        Households save, banks have deposits
+        Only one bank
+
+        Bank's balance sheet
+        assets = liquidity + lending + spare cash + current profit
+        liabilities = deposits + capital + retained profit
+    """
+    model.total_current_profit = model.total_borrowers_interest_payments \
+        + model.income_on_liquid_assets - model.total_savers_interest_payments \
+        - model.total_bad_debts
+    model.total_retained_profit = model.total_retained_profit + \
+        model.total_current_profit
+
+    model.total_deposits_at_end_of_month = np.round(
+        model.own_total_savings.sum(axis=1), 0)
+    model.total_lending_at_end_of_month = np.round(
+        model.own_outstanding_borrowing.sum(axis=1), 0)
+    # Macro-level variable
+    model.total_expenditure = np.round(
+        model.own_expenditure_this_month.sum(axis=1))
+
+    model.total_capital_at_end_of_month = model.capital
+
+    model.total_liabilities_at_end_of_month = model.total_deposits_at_end_of_month + \
+        model.total_capital_at_end_of_month + model.total_retained_profit
+
+    model.total_banks_liquidity = model.total_banks_required_liquidity + \
+        model.banks_spare_cash + model.total_retained_profit + \
+        model.total_capital_at_end_of_month
+
+    model.total_assets_at_end_of_month = model.total_banks_liquidity + \
+        model.total_lending_at_end_of_month
+
+    model.overall_balance_at_end_of_month = np.round(
+        model.total_assets_at_end_of_month - model.total_liabilities_at_end_of_month)
+
+    # nb total_lending_at_start_of_month takes repayments into account
+    model.check = model.total_lending_at_end_of_month - \
+        (model.total_lending_at_start_of_month + model.total_new_loans)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Reserve Ratio
+        model.reserve_ratio_percent = np.round(
+            model.total_banks_liquidity / model.total_deposits_at_end_of_month * 100, 3)
+
+        # Capital Adequacy Ratio
+        # Risk weight allocated in set-up
+        model.total_risk_weighted_exposure = model.total_lending_at_end_of_month * \
+            model.risk_weight_loan_percent / 100
+        model.capital_adequacy_ratio_percent = np.where(
+            model.total_risk_weighted_exposure > 0,
+            np.maximum(np.round((model.total_capital + model.total_retained_profit) /
+                                model.total_risk_weighted_exposure * 100, 2), 0), 0)
+
+    # Multipliers
+    # Households hold no cash, so the money supply = deposits and the bank deposit
+    # and money multipliers are the same
+    model.bank_deposit_multiplier = model.total_deposits_at_end_of_month / \
+        model.total_initial_deposits
+
+    # Calculates statistics on borrowers and savers
+    borrowers = model.own_outstanding_borrowing > 0
+    savers = model.own_total_savings >= 10
+    model.count_borrowers = borrowers.sum(axis=1)
+    model.count_savers = savers.sum(axis=1)
+    model.count_potential_borrowers = model.potential_borrower.sum(axis=1)
+    model.count_defaulters = model.defaulter.sum(axis=1)
+
+    # Find average amount borrowed and saved
+    model.average_amount_borrowed = np.where(
+        borrowers, model.own_outstanding_borrowing, 0).sum(axis=1) / \
+        np.maximum(model.count_borrowers, 1)
+    model.average_amount_saved = np.where(
+        savers, model.own_total_savings, 0).sum(axis=1) / np.maximum(model.count_savers, 1)
+
+
+def create_circles(model):
+    """ Create social circles """
+    # Only graphs built from positions change when households shift
+    if not model.circles or model.network_topology in nt.SPATIAL_TOPOLOGIES:
+        model.circles = [
+            nt.make_graph(model, points, rs.replicate_stream(model, "network", replicate))
+            for replicate, points in enumerate(model.pos)]
+    record_circles(model)
+
+
+def record_circles(model):
+    """ Records the size of each household's social circle """
+    model.n_of_my_circle = np.array(
+        [nk.circle_sizes(circles) for circles in model.circles])
+
+    model.min_circle_size = np.round(model.n_of_my_circle.min(axis=1), 2)
+    model.av_circle_size = np.round(model.n_of_my_circle.mean(axis=1), 2)
+    model.max_circle_size = np.round(model.n_of_my_circle.max(axis=1))
+    model.n_with_no_circle = model.n_with_no_circle + \
+        (model.n_of_my_circle == 0).sum(axis=1)
+
+
+def adopt(model, adopters):
+    """ Households adopt """
+    model.adoption = model.adoption | adopters
+    model.time_adopted = np.where(
+        adopters, model.month_counter[:, None], model.time_adopted)
+
+
+def initialize_thresholds_and_innovators(model):
+    """ Determine thresholds and innovators """
+    # Fixed threshold options - "Infection" models
+
+    # Select innovators randomly
+    if model.threshold == "One-scattered":
+        # Set threshold
+        model.my_threshold = np.where(
+            model.n_of_my_circle > 0, 1, model.my_threshold)
+        # Select innovators
+        innovators = sample_mask(rs.numpy_stream(model, "innovators"),
+                                 np.ones(model.households_shape, dtype=bool),
+                                 np.full(model.num_replicates, model.n_of_innovators))
+        adopt(model, innovators)
+        model.status = np.where(innovators, STATUS_INNOVATOR, model.status)
+
+    if model.threshold == "One-clustered":
+        # Set threshold
+        model.my_threshold = np.where(
+            model.n_of_my_circle > 0, 1, model.my_threshold)
+        # Select innovators to seed process
+        innovators = sample_mask(rs.numpy_stream(model, "innovators"),
+                                 np.ones(model.households_shape, dtype=bool),
+                                 np.ones(model.num_replicates, dtype=int))
+        adopt(model, innovators)
+        model.status = np.where(innovators, STATUS_INNOVATOR, model.status)
+        grow_network_of_innovators(model)
+
+        # to ensure exactly required number of innovators
+        surplus = np.maximum(model.count_of_innovators -
+                             model.n_of_innovators, 0)
+        unadopters = sample_mask(
+            rs.numpy_stream(model, "innovators"), model.status == STATUS_INNOVATOR, surplus)
+        model.status = np.where(unadopters, STATUS_NONE, model.status)
+        model.adoption = model.adoption & ~unadopters
+
+    # Heterogeneous Thresholds
+
+    if model.threshold == "Heterogeneous-uniform":
+        # Give everyone a social threshold from 1 to 100 distributed evenly
+        model.my_threshold = 1 + \
+            rs.numpy_stream(model, "thresholds").integers(0, 99, size=model.households_shape)
+        record_heterogeneous_thresholds(model)
+        select_innovators(model)
+
+    if model.threshold == "Heterogeneous-normal":
+        # Give everyone a social threshold distributed normally with mean as set
+        # by modeler and sd equal to the mean with adjustments to ensure values
+        # lie between 0 and 100
+        my_threshold = np.round(1 + rs.numpy_stream(model, "thresholds").normal(
+            model.mean_threshold, model.mean_threshold, size=model.households_shape))
+        model.my_threshold = np.where(
+            (my_threshold < 0) | (my_threshold > 100), model.mean_threshold, my_threshold)
+        record_heterogeneous_thresholds(model)
+        select_innovators(model)
+
+
+def grow_network_of_innovators(model):
+    """
+    Grows the network of innovators
+    Increases radius above reach to increase likelihood of a single cluster
+    rather than 2 or 3 smaller clusters
+    """
+    model.count_of_innovators = model.adoption.sum(axis=1)
+    for replicate in range(model.num_replicates):
+        adoption = model.adoption[replicate]
+        status = model.status[replicate]
+        time_adopted = model.time_adopted[replicate]
+        month = model.month_counter[replicate]
+        if model.network_topology == "radius":
+            indptr, indices, far = nk.radius_graph(
+                model.pos[replicate], model.space_size, model.social_reach + 10)
+        else:
+            indptr, indices, far = model.circles[replicate]
+        while adoption.sum() < model.n_of_innovators:
+            for adopter in np.flatnonzero(adoption):
+                # Get neighbors
+                neighbors = indices[indptr[adopter]:indptr[adopter + 1]]
+                neighbors = neighbors[far[indptr[adopter]:indptr[adopter + 1]]]
+                non_adopters = neighbors[~adoption[neighbors]]
+                if len(non_adopters) == 0:
+                    # no-one left in network, re-seed
+                    non_adopters = rs.replicate_stream(model, "spread", replicate).choice(
+                        np.flatnonzero(~adoption), 1)
+                adoption[non_adopters] = True
+                status[non_adopters] = STATUS_INNOVATOR
+                time_adopted[non_adopters] = month
+        model.count_of_innovators[replicate] = adoption.sum()
+
+
+def record_heterogeneous_thresholds(model):
+    """ Records heterogeneous thresholds """
+    model.het = "yes"
+
+    model.min_my_threshold = model.my_threshold.min(axis=1)
+    model.median_my_threshold = np.median(model.my_threshold, axis=1)
+    model.mean_my_threshold = model.my_threshold.mean(axis=1)
+    model.max_my_threshold = model.my_threshold.max(axis=1)
+
+
+def lowest_thresholds(my_threshold, count):
+    """
+    Marks the count households with the lowest thresholds in each
+    replicate, taking ties in household order as a stable sort would, by
+    partial selection instead of sorting every threshold
+    """
+    count = min(count, my_threshold.shape[1])
+    if count == 0:
+        return np.zeros(my_threshold.shape, dtype=bool)
+    cut_off = np.partition(my_threshold, count - 1, axis=1)[:, count - 1:count]
+    below = my_threshold < cut_off
+    ties = my_threshold == cut_off
+    return below | (ties & (np.cumsum(ties, axis=1) <=
+                            count - below.sum(axis=1, keepdims=True)))
+
+
+def select_innovators(model):
+    """ Selects innovators """
+    households_listed_by_threshold = lowest_thresholds(model.my_threshold, model.n_of_innovators)
+    adopt(model, households_listed_by_threshold)
+    model.status = np.where(households_listed_by_threshold,
+                            STATUS_INNOVATOR, model.status)
+    model.count_of_innovators = households_listed_by_threshold.sum(axis=1)
+
+
+def record_adoption_rate(model):
+    """ Record the adoption rate """
+    model.adopters_percent = model.adoption.sum(axis=1) / \
+        ps.households_per_percent(model.num_households)
+
+
+def shift(model):
+    """ Social shifting """
+    model.n_of_shifters = ps.count_of_percent(model.social_shift_percent, model.num_households)
+
+    shifters = sample_mask(rs.numpy_stream(model, "shift"),
+                           np.ones(model.households_shape, dtype=bool),
+                           np.full(model.num_replicates, model.n_of_shifters))
+
+    # Moves each shifter 1 cell in a random direction, staying put along
+    # any axis where the move would leave the space
+    direction = rs.numpy_stream(model, "shift").integers(1, 9, size=model.households_shape)
+    new_x = model.pos[..., 0] + MOVE_X[direction]
+    new_y = model.pos[..., 1] + MOVE_Y[direction]
+    new_x = np.where((new_x < 0) | (new_x > model.space_size-1),
+                     model.pos[..., 0], new_x)
+    new_y = np.where((new_y < 0) | (new_y > model.space_size-1),
+                     model.pos[..., 1], new_y)
+    model.pos = np.where(shifters[..., None],
+                         np.stack([new_x, new_y], axis=-1), model.pos)
+
+
+def spread(model):
+    """ Spread by influence or infection """
+    if model.threshold in ("One-scattered", "One-clustered"):
+        new_households = spread_by_infection(model)
+    else:
+        new_households = spread_by_influence(model)
+
+    # New adopters adopt
+    adopt(model, new_households)
+
+    # Record
+    record_adoption_rate(model)
+
+
+def spread_by_infection(model):
+    """ If any adopters in circle of non-adopters, non-adopters adopt """
+    non_adopters = ~model.adoption & (model.n_of_my_circle > 0)
+    n_of_adopting_friends = count_neighbors(model, model.adoption, False)
+    model.n_of_adopting_friends = np.where(
+        non_adopters, n_of_adopting_friends, model.n_of_adopting_friends)
+    return non_adopters & (n_of_adopting_friends >= 1)
+
+
+def spread_by_influence(model):
+    """ Spread by influence """
+    non_adopters = ~model.adoption
+    non_adopters_with_no_circle = non_adopters & (model.n_of_my_circle == 0)
+    model.my_friends_adoption_percent = np.where(
+        non_adopters_with_no_circle, model.adopters_percent[:, None],
+        model.my_friends_adoption_percent)
+
+    non_adopters_with_circle = non_adopters & (model.n_of_my_circle > 0)
+    n_of_adopting_friends = count_neighbors(model, model.adoption, True)
+    model.n_of_adopting_friends = np.where(
+        non_adopters_with_circle, n_of_adopting_friends, model.n_of_adopting_friends)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        model.my_friends_adoption_percent = np.where(
+            non_adopters_with_circle,
+            np.round((n_of_adopting_friends / model.n_of_my_circle)*100, 1),
+            model.my_friends_adoption_percent)
+
+    return non_adopters & (model.my_friends_adoption_percent >= model.my_threshold)
@@ -0,0 +1,357 @@
+""" The Bank Run Ensemble """
+import copy
+import numpy as np
+import ensemble_functions as ef
+import population_scaling as ps
+import withdrawal_engine as we
+import random_streams as rs
+
+
+class BankRunEnsemble:
+    """
+    Simulates many replicates of the bank run model together
+
+    Household state is shaped (replicates, households) and bank state is
+    shaped (replicates,). Replicates that have had a liquidity event are
+    masked out of every later month, as in BankRunModel.
+    """
+
+    def __init__(self, num_replicates=100, seed=None, num_households=1000,
+                 loan_type="mortgages", annual_loan_rate_percent=5,
+                 num_savers=100, equity_capital=1000, target_reserve_ratio_percent=10, shock=0,
+                 shock_month=12, defaulters_percent=1, annual_savers_rate_percent=2,
+                 target_capital_adequacy_ratio_percent=10, affordability_test=1,
+                 bank_run=1, social_shifting=1, social_shift_percent=5, social_reach=30,
+                 innovators_percent=2.5, threshold="One-scattered", mean_threshold=50,
+                 network_topology="radius", network_degree=10, network_rewire_percent=10,
+                 network_path=None, intra_month_withdrawals=0, common_random_numbers=0,
+                 population=None):
+        self.num_replicates = num_replicates
+        self.num_households = num_households
+        self.households_shape = (num_replicates, num_households)
+        self.rng = np.random.default_rng(seed)
+        # One substream per random event, when common_random_numbers is on
+        self.common_random_numbers = common_random_numbers
+        self.random_streams = rs.make_replicate_streams(self, seed)
+        self.loan_type = loan_type
+        self.num_savers = num_savers
+        self.equity_capital = equity_capital
+        self.target_reserve_ratio_percent = target_reserve_ratio_percent
+        self.shock = shock
+        self.shock_month = shock_month
+        self.defaulters_percent = defaulters_percent
+        self.annual_savers_rate_percent = annual_savers_rate_percent
+        self.target_capital_adequacy_ratio_percent = target_capital_adequacy_ratio_percent
+        self.affordability_test = affordability_test
+        self.bank_run = bank_run
+        self.social_shifting = social_shifting
+        self.social_shift_percent = social_shift_percent
+        self.social_reach = social_reach
+        self.innovators_percent = innovators_percent
+        self.threshold = threshold
+        self.mean_threshold = mean_threshold
+        self.network_topology = network_topology
+        self.network_degree = network_degree
+        self.network_rewire_percent = network_rewire_percent
+        self.network_path = network_path
+        self.intra_month_withdrawals = intra_month_withdrawals
+
+        self.risk_weight_liquid_percent = 0
+        self.risk_weight_mortgages_percent = 50
+        self.risk_weight_consumer_loans_percent = 100
+
+        self.annual_loan_rate_percent = annual_loan_rate_percent
+        self.monthly_loan_rate = (annual_loan_rate_percent/12)/100
+        self.monthly_savers_rate = 0
+        self.steps = 0
+        self.running = True
+
+        # This ensures density of agents is 1%
+        self.space_size = ps.space_size(self.num_households)
+
+        self.n_of_innovators = ps.count_of_percent(self.innovators_percent, self.num_households)
+
+        # Types of loan
+        if self.loan_type not in ("consumer loans", "mortgages"):
+            raise ValueError("The ensemble engine runs one loan type, "
+                             "'mortgages' or 'consumer loans', not " + repr(loan_type))
+        if self.loan_type == "consumer loans":
+            self.loan_term_months = 36
+            self.loan_size = 5
+            self.risk_weight_loan_percent = self.risk_weight_consumer_loans_percent
+
+        if self.loan_type == "mortgages":
+            self.loan_term_months = 300
+            self.loan_size = 100
+            self.risk_weight_loan_percent = self.risk_weight_mortgages_percent
+
+        if self.monthly_loan_rate > 0:
+            self.monthly_cost = round((self.loan_size*self.monthly_loan_rate) /
+                                      (1 - ((1 + self.monthly_loan_rate)
+                                            ** (-self.loan_term_months))), 3)
+        else:
+            self.monthly_cost = round(
+                self.loan_size / self.loan_term_months, 3)
+
+        # Bank state, one entry per replicate
+        self.initial_deposits = num_savers * 10
+        self.capital = np.full(num_replicates, equity_capital)
+        for name in ("total_initial_deposits", "total_deposits_at_start_of_month",
+                     "total_lending_at_start_of_month", "total_current_profit",
+                     "total_borrowers_interest_payments", "income_on_liquid_assets",
+                     "total_savers_interest_payments", "total_bad_debts",
+                     "total_retained_profit", "total_repayments", "total_capital_repayments",
+                     "total_capital", "total_banks_liquidity",
+                     "total_banks_required_liquidity", "banks_spare_cash",
+                     "total_capital_at_end_of_month", "total_assets_at_end_of_month",
+                     "total_lending_at_end_of_month", "total_deposits_at_end_of_month",
+                     "total_liabilities_at_end_of_month", "overall_balance_at_start_of_month",
+                     "overall_balance_at_end_of_month", "max_rwa",
+                     "total_risk_weighted_exposure", "new_loans_available",
+                     "capital_adequacy_ratio_percent", "total_new_loans", "check",
+                     "bank_deposit_multiplier", "reserve_ratio_percent",
+                     "max_lending_allowed", "new_loan_supply", "total_expenditure",
+                     "average_amount_borrowed", "average_amount_saved", "amount_withdrawn",
+                     "bank_liquid_assets", "adopters_percent", "min_circle_size",
+                     "av_circle_size", "max_circle_size", "min_my_threshold",
+                     "median_my_threshold", "mean_my_threshold", "max_my_threshold"):
+            setattr(self, name, np.zeros(num_replicates))
+        for name in ("num_defaulters", "num_loans", "num_new_borrowers", "month_loans_stop",
+                     "potential_borrowers", "car_constraint_indicator", "count_borrowers",
+                     "count_savers", "count_potential_borrowers", "count_defaulters",
+                     "liquidity_event", "liquidity_event_month", "count_of_innovators",
+                     "n_with_no_circle"):
+            setattr(self, name, np.zeros(num_replicates, dtype=int))
+        self.month_counter = np.ones(num_replicates, dtype=int)
+        # Withdrawals spread over the month, when intra_month_withdrawals is on
+        self.liquidity_event_day = np.full(num_replicates, np.nan)
+        self.liquidity_event_household = np.full(num_replicates, -1)
+        self.liquidity_path = np.zeros((num_replicates, we.DAYS_PER_MONTH), dtype=np.float32)
+        self.liquidity_paths = []
+        self.loan_error = np.zeros(num_replicates, dtype=bool)
+
+        # Household state, one row per replicate
+        for name in ("budget", "own_expenditure_this_month", "own_total_savings",
+                     "savers_interest_payment", "spent_loan", "own_outstanding_borrowing",
+                     "own_loan", "monthly_repayment", "borrowers_interest_payment",
+                     "capital_repayment", "my_threshold", "my_friends_adoption_percent"):
+            setattr(self, name, np.zeros(self.households_shape))
+        for name in ("affordable", "potential_borrower", "new_loan", "defaulter", "adoption"):
+            setattr(self, name, np.zeros(self.households_shape, dtype=bool))
+        for name in ("n_of_my_circle", "n_of_adopting_friends", "status", "time_adopted"):
+            setattr(self, name, np.zeros(self.households_shape, dtype=int))
+        # A precomputed population is shared read-only by every replicate
+        self.population = population
+        if population is None:
+            self.pos = rs.numpy_stream(self, "positions").integers(
+                0, self.space_size, size=self.households_shape + (2,))
+        else:
+            self.pos = np.broadcast_to(
+                population["pos"], self.households_shape + (2,))
+        self.circles = []
+
+        # Data collector, same reporters as BankRunModel
+        self.model_reporters = {
+            "Month": lambda a: a.month_counter,
+            "Cap_Ad": lambda a: a.capital_adequacy_ratio_percent,
+            "Reserve": lambda a: a.reserve_ratio_percent,
+            "Capital": lambda a: a.total_capital_at_end_of_month / 1000,
+            "Deposits": lambda a: a.total_deposits_at_end_of_month / 1000,
+            "Profits": lambda a: a.total_retained_profit / 1000,
+            "Liabilities": lambda a: a.total_liabilities_at_end_of_month / 1000,
+            "Liquid": lambda a: a.total_banks_liquidity / 1000,
+            "Lending": lambda a: a.total_lending_at_end_of_month / 1000,
+            "Assets": lambda a: a.total_assets_at_end_of_month / 1000,
+            "Balance": lambda a: a.overall_balance_at_end_of_month / 1000,
+            "Multiplier": lambda a: a.bank_deposit_multiplier,
+            "Car_Constraint_Indicator": lambda a: a.car_constraint_indicator,
+            "Borrowers": lambda a: a.count_borrowers,
+            "Savers": lambda a: a.count_savers,
+            "Pot_Borrow": lambda a: a.count_potential_borrowers,
+            "Def": lambda a: a.count_defaulters,
+            "Loans": lambda a: a.loan_size,
+            "Borrowings": lambda a: a.average_amount_borrowed,
+            "Savings": lambda a: a.average_amount_saved,
+            "Borrowers_Interest_Payments": lambda a: a.total_borrowers_interest_payments,
+            "Liquid_Asset_Income": lambda a: a.income_on_liquid_assets,
+            "Savers_Interest_Payments": lambda a: a.total_savers_interest_payments,
+            "Bad_Debts": lambda a: a.total_bad_debts,
+            "Current_Profit": lambda a: a.total_current_profit,
+            "Deposits_at_Start_of_Month": lambda a: a.total_deposits_at_start_of_month,
+            "Required_Liquidity": lambda a: a.total_banks_required_liquidity,
+            "Lending_at_Start_of_Month": lambda a: a.total_lending_at_start_of_month,
+            "New_Loans_Supply": lambda a: a.new_loan_supply,
+            "New_Loans_Made": lambda a: a.total_new_loans,
+            "Capital_Repayments": lambda a: a.total_capital_repayments,
+            "Total_Repayments": lambda a: a.total_repayments,
+            "Total_Expenditure": lambda a: a.total_expenditure,
+            "RWE": lambda a: a.total_risk_weighted_exposure,
+            "adopters_percent": lambda a: a.adopters_percent,
+            "Liquid_Assets": lambda a: a.bank_liquid_assets,
+            "liquidity_event": lambda a: a.liquidity_event,
+            "liquidity_event_month": lambda a: a.liquidity_event_month}
+        if self.intra_month_withdrawals:
+            self.model_reporters["liquidity_event_day"] = lambda a: a.liquidity_event_day
+            self.model_reporters["liquidity_event_household"] = \
+                lambda a: a.liquidity_event_household
+        self.model_vars = {name: [] for name in self.model_reporters}
+
+    def replicate_state(self):
+        """ Names of the attributes holding per-replicate state """
+        return [name for name, value in vars(self).items()
+                if isinstance(value, np.ndarray) and value.shape[:1] == (self.num_replicates,)]
+
+    def select(self, replicates):
+        """ Returns a copy of the ensemble holding only the given replicates """
+        subset = copy.copy(self)
+        for name in self.replicate_state():
+            state = getattr(self, name)
+            if state.strides[0] == 0:
+                # State shared by every replicate stays shared
+                setattr(subset, name, np.broadcast_to(
+                    state[0], (len(replicates),) + state.shape[1:]))
+            else:
+                setattr(subset, name, state[replicates])
+        if self.circles:
+            subset.circles = [self.circles[replicate] for replicate in replicates]
+        if self.random_streams is not None:
+            subset.random_streams = self.random_streams.select(replicates)
+        subset.num_replicates = len(replicates)
+        subset.households_shape = (len(replicates), self.num_households)
+        return subset
+
+    def update(self, replicates, subset):
+        """ Writes the state of a subset back into the given replicates """
+        for name in self.replicate_state():
+            subset_state = getattr(subset, name)
+            if subset_state.strides[0] == 0:
+                continue
+            state = getattr(self, name)
+            if not state.flags.writeable:
+                # Copy shared state only once a replicate changes it
+                state = np.array(state)
+                setattr(self, name, state)
+            state[replicates] = subset_state
+        if self.circles:
+            for position, replicate in enumerate(replicates):
+                self.circles[replicate] = subset.circles[position]
+
+    def step(self):
+        """ Advance every replicate by one step """
+        # Replicates whose withdrawals are timed this step
+        drained = np.zeros(self.num_replicates, dtype=bool)
+        if self.steps == 0:
+            # Set initial deposits
+            ef.set_initial_deposits(self)
+
+            if self.population is None:
+                # Allocate budgets to households
+                ef.allocate_budget(self)
+
+                # Determine savers
+                ef.determine_savers(self)
+            else:
+                # Budgets, savers and circles come from the shared population
+                ef.use_population(self)
+
+            if self.bank_run:  # Bank run is on
+                # Create social circles
+                if self.population is None:
+                    ef.create_circles(self)
+                else:
+                    ef.record_circles(self)
+
+                # Initialize thresholds and determine innovators
+                ef.initialize_thresholds_and_innovators(self)
+
+            # Banks make loans
+            ef.make_loans(self)
+
+            # Borrowers spend loans
+            ef.spend_loans(self)
+
+            # Record the adoption rate
+            ef.record_adoption_rate(self)
+
+            # Collect data at end of month
+            ef.collect_data_at_end_of_month(self)
+
+        else:
+            # Replicates with a liquidity event are masked out
+            live = np.flatnonzero(self.liquidity_event == 0)
+            drained[live] = bool(self.bank_run)
+            if len(live) == self.num_replicates:
+                self.step_month(self)
+            elif len(live) > 0:
+                subset = self.select(live)
+                self.step_month(subset)
+                self.update(live, subset)
+
+        # Collect data
+        for name, reporter in self.model_reporters.items():
+            self.model_vars[name].append(np.broadcast_to(
+                reporter(self), (self.num_replicates,)).copy())
+        if self.intra_month_withdrawals:
+            # Paths of replicates without withdrawals this step are nan
+            self.liquidity_paths.append(np.where(
+                drained[:, None], self.liquidity_path, np.nan).astype(np.float32))
+
+        # Advance the model by one step
+        self.steps += 1
+
+    @staticmethod
+    def step_month(model):
+        """ Runs one month for replicates without a liquidity event """
+        # Monthly reset for necessary variables
+        ef.month_reset(model)
+
+        # Banks collect debts
+        ef.collect_debts(model)
+
+        if model.annual_savers_rate_percent > 0:
+            ef.pay_interest_to_savers(model)
+            ef.collect_interest_on_liquid_assets(model)
+
+        # Households make deposits
+        ef.make_deposits(model)
+
+        # Banks make loans
+        ef.make_loans(model)
+
+        # Borrowers spend loans
+        ef.spend_loans(model)
+
+        if model.bank_run:
+            # Adopters make withdrawals
+            ef.make_withdrawals(model)
+
+        # Move households and create new circles
+        if model.social_shifting:
+            ef.shift(model)
+            ef.create_circles(model)
+
+        # Spread adoption
+        ef.spread(model)
+
+        # Collect data at end of month
+        ef.collect_data_at_end_of_month(model)
+
+    def run(self, max_steps):
+        """ Runs every replicate for max_steps + 1 steps, as mesa.batch_run does """
+        while self.steps <= max_steps:
+            self.step()
+
+    def get_model_vars_dataframe(self):
+        """
+        Returns the collected data with one row per replicate and step, laid
+        out like the output of mesa.batch_run
+        """
+        import pandas as pd
+
+        num_steps = len(self.model_vars["Month"])
+        data = {"iteration": np.tile(np.arange(self.num_replicates), num_steps),
+                "Step": np.repeat(np.arange(num_steps), self.num_replicates)}
+        for name, values in self.model_vars.items():
+            data[name] = np.concatenate(values) if values else np.zeros(0)
+        return pd.DataFrame(data).sort_values(
+            ["iteration", "Step"], kind="stable").reset_index(drop=True)
@@ -0,0 +1,176 @@
+""" Golden Runs
+
+Regression harness for faster engines. Records the full DataCollector output
+of the reference BankRunModel for fixed seeds across every threshold type,
+both loan types and shock on and off, then reruns the same scenarios with
+another engine, compares the results with configurable tolerances and
+reports the speedup.
+
+An engine is any function engine(parameters, seed, max_steps) that returns
+a DataFrame of model reporters with one row per step.
+"""
+import itertools
+import json
+import random
+import time
+import numpy as np
+import pandas as pd
+
+THRESHOLDS = ["One-scattered", "One-clustered",
+              "Heterogeneous-uniform", "Heterogeneous-normal"]
+LOAN_TYPES = ["mortgages", "consumer loans"]
+SHOCKS = [0, 1]
+
+GOLDEN_SCENARIOS = [{"threshold": threshold, "loan_type": loan_type, "shock": shock}
+                    for threshold, loan_type, shock in itertools.product(
+                        THRESHOLDS, LOAN_TYPES, SHOCKS)]
+
+# Columns identifying a run in a golden file
+RUN_COLUMNS = ["scenario", "seed", "Step"]
+
+# Columns describing a run rather than holding its results
+DESCRIPTION_COLUMNS = RUN_COLUMNS + ["parameters", "reference_seconds"]
+
+
+def reference_engine(parameters, seed, max_steps):
+    """
+    Runs the reference BankRunModel
+    The model draws from the global random and np.random generators, and
+    Mesa seeds the model's own generator from random, so seeding both makes
+    the run reproducible
+    """
+    from model import BankRunModel
+
+    random.seed(seed)
+    np.random.seed(seed)
+    model = BankRunModel(**parameters)
+    for _ in range(max_steps + 1):
+        model.step()
+    return model.datacollector.get_model_vars_dataframe()
+
+
+def ensemble_engine(parameters, seed, max_steps):
+    """
+    Runs a single replicate of BankRunEnsemble
+    The ensemble draws its own random streams, so compare it with
+    mode="statistical" over many seeds
+    """
+    from ensemble_model import BankRunEnsemble
+
+    ensemble = BankRunEnsemble(num_replicates=1, seed=seed, **parameters)
+    ensemble.run(max_steps)
+    return ensemble.get_model_vars_dataframe().drop(columns=["iteration", "Step"])
+
+
+def run_scenarios(engine, scenarios, seeds, max_steps):
+    """
+    Runs every scenario and seed with an engine
+    Returns the stacked results and the total time spent in the engine
+    """
+    frames = []
+    seconds = 0
+    for count, parameters in enumerate(scenarios):
+        for seed in seeds:
+            start = time.perf_counter()
+            results = engine(parameters, seed, max_steps)
+            seconds += time.perf_counter() - start
+            results = results.reset_index(drop=True)
+            results.insert(0, "Step", np.arange(len(results)))
+            results.insert(0, "seed", seed)
+            results.insert(0, "scenario", count)
+            results["parameters"] = json.dumps(parameters)
+            frames.append(results)
+    return pd.concat(frames, ignore_index=True), seconds
+
+
+def record_golden_runs(path, seeds=(0, 1, 2), max_steps=119, scenarios=None,
+                       engine=reference_engine):
+    """
+    Records golden runs to a CSV file
+    The time taken is stored with them so later comparisons can report speedups
+    """
+    scenarios = GOLDEN_SCENARIOS if scenarios is None else scenarios
+    golden, seconds = run_scenarios(engine, scenarios, seeds, max_steps)
+    golden["reference_seconds"] = seconds
+    golden.to_csv(path, index=False)
+    return golden
+
+
+def load_golden_runs(path):
+    """ Loads golden runs and the scenarios they cover """
+    golden = pd.read_csv(path)
+    scenarios = golden.drop_duplicates("scenario").sort_values("scenario")
+    return golden, [json.loads(parameters) for parameters in scenarios["parameters"]]
+
+
+def compare_engine(engine, path, rtol=0.0, atol=1e-9, mode="exact", z_score=3.0,
+                   columns=None):
+    """
+    Reruns the golden scenarios with an engine and compares the results
+
+    mode="exact" compares every step of every seed, for engines that draw
+    the same random numbers as the reference
+    mode="statistical" compares the mean over seeds at every step, allowing
+    z_score standard errors on top of the tolerances, for engines with
+    their own random streams
+
+    Returns a dict with passed, the mismatching values, both run times and
+    the speedup
+    """
+    golden, scenarios = load_golden_runs(path)
+    seeds = sorted(golden["seed"].unique().tolist())
+    max_steps = int(golden["Step"].max())
+    candidate, seconds = run_scenarios(engine, scenarios, seeds, max_steps)
+
+    if columns is None:
+        columns = [name for name in golden.columns
+                   if name in candidate.columns and name not in DESCRIPTION_COLUMNS]
+
+    if mode == "exact":
+        expected = golden.set_index(RUN_COLUMNS)[columns]
+        actual = candidate.set_index(RUN_COLUMNS)[columns].reindex(expected.index)
+        tolerance = atol + rtol * expected.abs()
+    else:
+        grouped_golden = golden.groupby(["scenario", "Step"])[columns]
+        grouped_candidate = candidate.groupby(["scenario", "Step"])[columns]
+        expected = grouped_golden.mean()
+        actual = grouped_candidate.mean().reindex(expected.index)
+        standard_error = np.sqrt(grouped_golden.var().fillna(0) / len(seeds) +
+                                 grouped_candidate.var().fillna(0) / len(seeds))
+        tolerance = atol + rtol * expected.abs() + z_score * standard_error
+
+    failed = ((actual - expected).abs() > tolerance) | actual.isna()
+    rows, cols = np.nonzero(failed.to_numpy())
+    mismatches = pd.DataFrame(
+        {name: failed.index.get_level_values(name)[rows] for name in failed.index.names})
+    mismatches["column"] = np.array(columns, dtype=object)[cols]
+    mismatches["expected"] = expected.to_numpy()[rows, cols]
+    mismatches["actual"] = actual.to_numpy()[rows, cols]
+
+    reference_seconds = float(golden["reference_seconds"].iloc[0])
+    return {"passed": len(mismatches) == 0,
+            "mismatches": mismatches,
+            "reference_seconds": reference_seconds,
+            "engine_seconds": seconds,
+            "speedup": reference_seconds / seconds if seconds > 0 else float("inf")}
+
+
+def check_paired_runs(scenario=None, iterations=4, max_steps=10, seed=1, number_processes=1):
+    """
+    Runs one scenario twice as a pair with common random numbers, in this
+    process by default, and checks that both runs follow identical paths
+    Returns a dict with passed and the reporters that differ
+    """
+    import headless_runner as hr
+
+    scenario = scenario or {"threshold": "Heterogeneous-normal"}
+    # Sweeping the first parameter over the same value twice gives the pair
+    sweep = dict(scenario)
+    name = next(iter(sweep))
+    sweep[name] = [sweep[name]] * 2
+    first, second = hr.batch_run(sweep, iterations, max_steps, number_processes, seed,
+                                 common_random_numbers=True)
+    mismatches = [reporter for reporter in first.model_vars
+                  if not np.array_equal(first.model_vars[reporter],
+                                        second.model_vars[reporter], equal_nan=True)]
+    return {"passed": len(mismatches) == 0, "mismatches": mismatches}
@@ -0,0 +1,354 @@
+""" Headless Runner
+
+Runs parameter sweeps of the bank run model with the ensemble engine. Only
+NumPy and the ensemble modules are imported, so worker processes start
+quickly; pandas is imported only when results are turned into a DataFrame.
+Worker pools are started once with the model modules already loaded and can
+be reused across many sweeps.
+
+Command line use:
+    python headless_runner.py --parameters '{"threshold": "One-scattered"}'
+        --iterations 1000 --max-steps 119 --processes 4 --output results.npz
+        --progress progress.jsonl
+
+Comparing scenarios in pairs, with common random numbers:
+    python headless_runner.py --parameters '{"social_shifting": [0, 1]}'
+        --iterations 200 --paired --output paired.npz
+
+Searching for the value of one parameter where the liquidity event
+probability crosses 50%, reusing runs kept in a result store:
+    python headless_runner.py --search social_reach 10 60 --tolerance 1
+        --store results --output search.json
+"""
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing
+import time
+import numpy as np
+import ensemble_model as em
+import shared_population as sp
+import progress_monitor as pm
+
+# Modules every worker process loads before it takes any work
+PRELOAD_MODULES = ["ensemble_model", "ensemble_functions", "neighbor_kernels",
+                   "shared_population", "loan_market", "network_topology",
+                   "population_scaling", "withdrawal_engine", "random_streams",
+                   "progress_monitor"]
+
+
+class RunResults:
+    """
+    Data collected from the replicates of one parameter combination
+    Each reporter is held as an array shaped (steps, replicates); with
+    intra_month_withdrawals on, liquidity_path holds the liquid assets at the
+    end of each day, shaped (steps, replicates, days), nan in steps without
+    timed withdrawals
+    timings holds the seconds spent in each phase of the run
+    """
+
+    def __init__(self, parameters, model_vars, timings=None):
+        self.parameters = parameters
+        self.model_vars = model_vars
+        self.timings = timings or {}
+
+    @property
+    def num_replicates(self):
+        """ Number of replicates """
+        return len(self.model_vars["Month"][0])
+
+    @property
+    def num_steps(self):
+        """ Number of collected steps """
+        return len(self.model_vars["Month"])
+
+    def final(self, name):
+        """ Value of a reporter at the last step of every replicate """
+        return self.model_vars[name][-1]
+
+    @classmethod
+    def combine(cls, results):
+        """ Joins results of the same parameters along the replicate axis """
+        model_vars = {name: np.concatenate([result.model_vars[name] for result in results],
+                                           axis=1)
+                      for name in results[0].model_vars}
+        timings = {phase: sum(result.timings.get(phase, 0) for result in results)
+                   for phase in results[0].timings}
+        return cls(results[0].parameters, model_vars, timings)
+
+    def to_dataframe(self, first_run_id=0):
+        """ Returns the data laid out like the output of mesa.batch_run """
+        import pandas as pd
+
+        num_replicates = self.num_replicates
+        num_steps = self.num_steps
+        iterations = np.repeat(np.arange(num_replicates), num_steps)
+        data = {"RunId": iterations + first_run_id,
+                "iteration": iterations,
+                "Step": np.tile(np.arange(num_steps), num_replicates)}
+        for name, value in self.parameters.items():
+            data[name] = [value] * len(iterations)
+        for name, values in self.model_vars.items():
+            if values.ndim == 2:
+                data[name] = values.T.ravel()
+        return pd.DataFrame(data)
+
+
+def results_dataframe(results):
+    """ Returns the results of a sweep as one DataFrame """
+    import pandas as pd
+
+    frames = []
+    first_run_id = 0
+    for result in results:
+        frames.append(result.to_dataframe(first_run_id))
+        first_run_id += result.num_replicates
+    return pd.concat(frames, ignore_index=True)
+
+
+def parameter_grid(parameters):
+    """
+    Expands parameters into every combination
+    Values that are lists, tuples or ranges are swept, anything else is fixed
+    """
+    names = list(parameters)
+    values = [value if isinstance(value, (list, tuple, range)) else [value]
+              for value in parameters.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def run_ensemble(parameters, iterations, max_steps, seed=None, population=None):
+    """ Runs one ensemble of iterations replicates and returns its results """
+    start = time.perf_counter()
+    ensemble = em.BankRunEnsemble(
+        num_replicates=iterations, seed=seed, population=population, **parameters)
+    ensemble.step()
+    setup = time.perf_counter()
+    ensemble.run(max_steps)
+    months = time.perf_counter()
+    model_vars = {name: np.stack(values)
+                  for name, values in ensemble.model_vars.items()}
+    if ensemble.intra_month_withdrawals:
+        model_vars["liquidity_path"] = np.stack(ensemble.liquidity_paths)
+    timings = {"setup": setup - start, "months": months - setup,
+               "collect": time.perf_counter() - months}
+    return RunResults(parameters, model_vars, timings)
+
+
+def run_task(task):
+    """ Runs one block of replicates in a worker process """
+    parameters, iterations, max_steps, seed, population = task
+    if population is not None:
+        population = sp.attach(population)
+    return run_ensemble(parameters, iterations, max_steps, seed, population)
+
+
+def preload():
+    """ Imports the model modules in a worker process """
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+
+
+def pool_context():
+    """
+    Context for starting worker processes
+    Uses a fork server preloaded with the model modules where available, so
+    each worker is forked from a process that has already imported them
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(PRELOAD_MODULES)
+    else:
+        context = multiprocessing.get_context("spawn")
+    return context
+
+
+def make_pool(number_processes=None):
+    """ Starts worker processes with the model modules already loaded """
+    return pool_context().Pool(number_processes, initializer=preload)
+
+
+def publish_results(publisher, blocks_per_combination, block_results):
+    """ Publishes each block of results to a ProgressPublisher as it arrives """
+    for count, block_result in enumerate(block_results):
+        publisher.publish(
+            "block", scenario=count // blocks_per_combination,
+            parameters=block_result.parameters,
+            runs=block_result.num_replicates,
+            liquidity_events=int(block_result.final("liquidity_event").sum()),
+            timings=block_result.timings)
+        yield block_result
+
+
+def batch_run(parameters, iterations=1, max_steps=119, number_processes=1, seed=None,
+              block_size=100, pool=None, population=None, progress=None,
+              common_random_numbers=False):
+    """
+    Runs iterations replicates of every parameter combination
+    Replicates are simulated in blocks of up to block_size; blocks run in
+    the given pool, in a new pool of number_processes workers, or in this
+    process when number_processes is 1
+    population is an optional SharedPopulation used by every replicate; every
+    combination must use the parameters it was drawn with
+    progress is an optional path to publish progress to, for progress_monitor
+    With common_random_numbers, replicate i of every combination draws from
+    the same random substreams, so combinations can be compared in pairs
+    Returns one RunResults per parameter combination
+    """
+    combinations = parameter_grid(parameters)
+    if population is not None:
+        for combination in combinations:
+            population.check(combination)
+        population = population.directory
+    blocks = [min(block_size, iterations - start)
+              for start in range(0, iterations, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(combinations) * len(blocks))
+    if common_random_numbers:
+        # Every combination reuses the seeds of the first, each from a fresh
+        # copy, since spawning substreams changes a seed sequence
+        combinations = [dict(combination, common_random_numbers=1)
+                        for combination in combinations]
+        seeds = [np.random.SeedSequence(block_seed.entropy, spawn_key=block_seed.spawn_key)
+                 for _ in combinations for block_seed in seeds[:len(blocks)]]
+    tasks = [(combination, block, max_steps, seeds[count], population)
+             for count, (combination, block) in enumerate(
+                 itertools.product(combinations, blocks))]
+
+    publisher = None
+    if progress is not None:
+        publisher = pm.ProgressPublisher(progress)
+        publisher.publish("start", total_runs=iterations * len(combinations),
+                          scenarios=len(combinations))
+
+    new_pool = None
+    if pool is None and number_processes != 1:
+        pool = new_pool = make_pool(number_processes)
+    try:
+        if pool is not None:
+            block_results = pool.imap(run_task, tasks)
+        else:
+            block_results = map(run_task, tasks)
+        if publisher is not None:
+            block_results = publish_results(publisher, len(blocks), block_results)
+        block_results = list(block_results)
+    finally:
+        if new_pool is not None:
+            new_pool.terminate()
+        if publisher is not None:
+            publisher.publish("finish")
+            publisher.close()
+
+    return [RunResults.combine(block_results[start:start + len(blocks)])
+            for start in range(0, len(block_results), len(blocks))]
+
+
+def paired_differences(results, reporters=("liquidity_event", "liquidity_event_month",
+                                           "adopters_percent")):
+    """
+    Compares the final values of each reporter, replicate by replicate, of
+    every combination with those of the first
+    Returns, for every later combination, its parameters and the mean and
+    standard error of each paired difference
+    """
+    baseline = results[0]
+    differences = []
+    for result in results[1:]:
+        summary = {"parameters": result.parameters}
+        for name in reporters:
+            difference = result.final(name) - baseline.final(name)
+            summary[name] = {"mean": float(difference.mean()),
+                             "standard_error": float(difference.std(ddof=1) /
+                                                     np.sqrt(len(difference)))
+                             if len(difference) > 1 else float("nan")}
+        differences.append(summary)
+    return differences
+
+
+def paired_run(parameters, iterations=1, max_steps=119, number_processes=1, seed=None,
+               block_size=100, pool=None, reporters=("liquidity_event", "liquidity_event_month",
+                                                     "adopters_percent")):
+    """
+    Runs every combination of parameters with common random numbers and
+    compares each with the first, as in paired_differences
+    Returns the results and the paired differences
+    """
+    results = batch_run(parameters, iterations, max_steps, number_processes, seed,
+                        block_size, pool, common_random_numbers=True)
+    return results, paired_differences(results, reporters)
+
+
+def save_results(results, path):
+    """ Saves the results of a sweep to a compressed .npz file """
+    arrays = {f"{count}/{name}": values
+              for count, result in enumerate(results)
+              for name, values in result.model_vars.items()}
+    np.savez_compressed(path, parameters=json.dumps(
+        [result.parameters for result in results]), **arrays)
+
+
+def load_results(path):
+    """ Loads results saved with save_results """
+    with np.load(path) as saved:
+        parameters = json.loads(str(saved["parameters"]))
+        results = []
+        for count, combination in enumerate(parameters):
+            prefix = f"{count}/"
+            model_vars = {name[len(prefix):]: saved[name]
+                          for name in saved.files if name.startswith(prefix)}
+            results.append(RunResults(combination, model_vars))
+    return results
+
+
+def main():
+    """ Runs a sweep from the command line """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parameters", default="{}",
+                        help="JSON object of BankRunModel parameters; lists are swept")
+    parser.add_argument("--iterations", type=int, default=1)
+    parser.add_argument("--max-steps", type=int, default=119)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", required=True,
+                        help="Path of the .npz file, or the .json file of a search, to write")
+    parser.add_argument("--progress", default=None,
+                        help="Path of a file to publish progress to, for progress_monitor.py")
+    parser.add_argument("--search", nargs=3, metavar=("PARAMETER", "LOW", "HIGH"),
+                        help="Search for the tipping point of PARAMETER between LOW and HIGH")
+    parser.add_argument("--target", type=float, default=0.5,
+                        help="Liquidity event probability to search for")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="Width of the bracket at which the search stops")
+    parser.add_argument("--store", default=None,
+                        help="Directory of a result store to reuse runs from")
+    parser.add_argument("--paired", action="store_true",
+                        help="Run combinations with common random numbers and print the "
+                             "paired differences from the first combination")
+    arguments = parser.parse_args()
+
+    if arguments.search is not None:
+        import threshold_search
+        import result_store
+
+        parameter, low, high = arguments.search
+        integer = low.isdigit() and high.isdigit()
+        store = result_store.ResultStore(arguments.store) if arguments.store else None
+        search = threshold_search.find_tipping_point(
+            parameter, int(low) if integer else float(low), int(high) if integer else float(high),
+            json.loads(arguments.parameters), arguments.target, arguments.tolerance, integer,
+            arguments.max_steps, arguments.seed or 0, store=store,
+            number_processes=arguments.processes)
+        with open(arguments.output, "w") as output:
+            json.dump(search, output, indent=1)
+        return
+
+    results = batch_run(json.loads(arguments.parameters), arguments.iterations,
+                        arguments.max_steps, arguments.processes, arguments.seed,
+                        progress=arguments.progress, common_random_numbers=arguments.paired)
+    save_results(results, arguments.output)
+    if arguments.paired:
+        print(json.dumps(paired_differences(results), indent=1))
+
+
+if __name__ == "__main__":
+    main()
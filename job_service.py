@@ -0,0 +1,165 @@
+""" Job Service
+
+Runs sweeps in the background so a notebook stays responsive. The service
+runs an asyncio event loop on its own thread, which feeds blocks of
+replicates from a priority queue to a pool of worker processes. Each
+parameter combination is a job keyed by its parameters, iterations,
+max_steps and seed; submitting a job that is queued, running or finished
+returns the same results without running it again. Jobs without a seed
+are never shared. With a ResultStore, finished jobs are also kept on disk
+and shared across sessions.
+
+Notebook use:
+    service = JobService(number_processes=4)
+    job = service.submit({"threshold": ["One-scattered", "One-clustered"]},
+                         iterations=1000, seed=1, priority=1)
+    job.done()           # poll
+    results = job.result()   # or: results = await job
+"""
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import headless_runner as hr
+
+
+def job_key(parameters, iterations, max_steps, seed, block_size):
+    """ Key identifying a job whose results can be shared """
+    return (json.dumps(parameters, sort_keys=True), iterations, max_steps, seed, block_size)
+
+
+class Job:
+    """
+    A submitted sweep, with one future per parameter combination
+    Poll with done() or progress(), wait with result() or await the job
+    """
+
+    def __init__(self, futures):
+        self.futures = futures
+
+    def done(self):
+        """ Whether every combination has finished """
+        return all(future.done() for future in self.futures)
+
+    def progress(self):
+        """ Number of finished combinations and number of combinations """
+        return sum(future.done() for future in self.futures), len(self.futures)
+
+    def result(self, timeout=None):
+        """ Waits for the results, one RunResults per combination """
+        return [future.result(timeout) for future in self.futures]
+
+    def __await__(self):
+        return asyncio.gather(
+            *[asyncio.wrap_future(future) for future in self.futures]).__await__()
+
+
+class JobService:
+    """ Background runner of sweeps with priorities and shared results """
+
+    def __init__(self, number_processes=None, block_size=100, store=None):
+        self.number_processes = number_processes or os.cpu_count()
+        self.block_size = block_size
+        self.store = store
+        self.executor = ProcessPoolExecutor(
+            self.number_processes, mp_context=hr.pool_context(), initializer=hr.preload)
+        # Jobs by key, as asyncio tasks of the service loop
+        self.jobs = {}
+        self.submitted = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.workers = asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+
+    async def start(self):
+        """ Creates the queue and one worker coroutine per process """
+        self.queue = asyncio.PriorityQueue()
+        return [self.loop.create_task(self.work()) for _ in range(self.number_processes)]
+
+    async def work(self):
+        """ Runs queued blocks, highest priority first, in the worker processes """
+        while True:
+            _, _, task, future = await self.queue.get()
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(await self.loop.run_in_executor(
+                    self.executor, hr.run_task, task))
+            except Exception as error:
+                if not future.cancelled():
+                    future.set_exception(error)
+
+    async def run_job(self, parameters, iterations, max_steps, seed, priority):
+        """
+        Queues the blocks of one combination and combines their results
+        Seeded jobs are taken from and added to the result store, if any
+        """
+        stored = self.store is not None and seed is not None
+        if stored:
+            results = self.store.get("ensemble", parameters, seed, max_steps,
+                                     iterations=iterations, block_size=self.block_size)
+            if results is not None:
+                return results
+
+        blocks = [min(self.block_size, iterations - start)
+                  for start in range(0, iterations, self.block_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(blocks))
+        futures = []
+        for block, block_seed in zip(blocks, seeds):
+            future = self.loop.create_future()
+            self.submitted += 1
+            await self.queue.put((-priority, self.submitted,
+                                  (parameters, block, max_steps, block_seed, None), future))
+            futures.append(future)
+        results = hr.RunResults.combine(await asyncio.gather(*futures))
+        if stored:
+            self.store.put(results, "ensemble", parameters, seed, max_steps,
+                           iterations=iterations, block_size=self.block_size)
+        return results
+
+    async def results(self, parameters, iterations, max_steps, seed, priority):
+        """ Results of one combination, shared with identical jobs """
+        key = job_key(parameters, iterations, max_steps, seed, self.block_size)
+        job = self.jobs.get(key)
+        if job is None or (job.done() and job.exception() is not None):
+            job = self.loop.create_task(
+                self.run_job(parameters, iterations, max_steps, seed, priority))
+            if seed is not None:
+                self.jobs[key] = job
+        return await asyncio.shield(job)
+
+    def submit(self, parameters, iterations=1, max_steps=119, seed=None, priority=0):
+        """
+        Submits every combination of parameters, as in headless_runner.batch_run
+        Jobs with a higher priority are run first
+        Returns a Job straight away
+        """
+        return Job([asyncio.run_coroutine_threadsafe(
+            self.results(combination, iterations, max_steps, seed, priority), self.loop)
+            for combination in hr.parameter_grid(parameters)])
+
+    def queued(self):
+        """ Number of blocks waiting for a worker """
+        return self.queue.qsize()
+
+    async def stop(self):
+        """ Cancels the worker coroutines """
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def close(self):
+        """ Stops the workers, the processes and the event loop """
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.executor.shutdown(cancel_futures=True)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
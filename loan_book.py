@@ -0,0 +1,203 @@
+""" Loan Book
+
+Loans held by households in a mixed portfolio, one row per loan, so that a
+household can hold a mortgage and a consumer loan at the same time. Each
+product has its own size, term, rate and risk weight. Repayments,
+amortization and risk-weighted exposure are computed as array operations
+over the whole book and summed per household or per product with bincount,
+so the monthly cost does not grow with the number of products.
+"""
+import math
+import numpy as np
+
+# Product defaults, as used by runs with a single loan type
+LOAN_PRODUCTS = {"mortgages": {"loan_size": 100, "loan_term_months": 300,
+                               "risk_weight_percent": 50, "share_percent": 50},
+                 "consumer loans": {"loan_size": 5, "loan_term_months": 36,
+                                    "risk_weight_percent": 100, "share_percent": 50}}
+
+
+def monthly_cost(loan_size, annual_rate_percent, loan_term_months):
+    """ Fixed monthly repayment of a loan, as set in setup """
+    monthly_rate = (annual_rate_percent/12)/100
+    if monthly_rate > 0:
+        return round((loan_size*monthly_rate) /
+                     (1 - ((1 + monthly_rate) ** (-loan_term_months))), 3)
+    return round(loan_size / loan_term_months, 3)
+
+
+def make_products(annual_loan_rate_percent, loan_products=None):
+    """
+    Builds the products of a mixed portfolio
+    loan_products overrides the defaults by product name, for example
+    {"consumer loans": {"annual_rate_percent": 9, "share_percent": 30}};
+    new products must give every field
+    share_percent is the share of the funds for new loans each product gets
+    """
+    loan_products = loan_products or {}
+    names = list(LOAN_PRODUCTS) + [name for name in loan_products if name not in LOAN_PRODUCTS]
+    products = []
+    for name in names:
+        product = dict(LOAN_PRODUCTS.get(name, {}), name=name,
+                       annual_rate_percent=annual_loan_rate_percent)
+        product.update(loan_products.get(name, {}))
+        product["monthly_rate"] = (product["annual_rate_percent"]/12)/100
+        product["monthly_cost"] = monthly_cost(
+            product["loan_size"], product["annual_rate_percent"], product["loan_term_months"])
+        products.append(product)
+    return products
+
+
+class LoanBook:
+    """ Every outstanding loan of a mixed portfolio """
+
+    def __init__(self, model):
+        self.num_households = model.num_households
+        # Budgets are fixed after setup
+        self.budgets = np.array([household.budget for household in model.households])
+        self.products = model.loan_products
+        self.loan_size = np.array([product["loan_size"] for product in self.products])
+        self.monthly_rate = np.array([product["monthly_rate"] for product in self.products])
+        self.monthly_cost = np.array([product["monthly_cost"] for product in self.products])
+        self.risk_weight = np.array(
+            [product["risk_weight_percent"] for product in self.products]) / 100
+        self.share = np.array([product["share_percent"] for product in self.products]) / 100
+
+        # One entry per loan
+        self.holder = np.zeros(0, dtype=int)
+        self.product = np.zeros(0, dtype=int)
+        self.own_loan = np.zeros(0)
+        self.outstanding = np.zeros(0)
+        self.repayment = np.zeros(0)
+
+    def per_household(self, values):
+        """ Sums a value of every loan by household """
+        return np.bincount(self.holder, values, minlength=self.num_households)
+
+    def per_product(self, values):
+        """ Sums a value of every loan by product """
+        return np.bincount(self.product, values, minlength=len(self.products))
+
+    def holds(self):
+        """ Which products each household holds, shaped (households, products) """
+        holds = np.zeros((self.num_households, len(self.products)), dtype=bool)
+        holds[self.holder, self.product] = True
+        return holds
+
+    def originate(self, holders, product):
+        """ Adds new loans of one product """
+        holders = np.asarray(holders, dtype=int)
+        size = self.loan_size[product]
+        self.holder = np.append(self.holder, holders)
+        self.product = np.append(self.product, np.full(len(holders), product))
+        self.own_loan = np.append(self.own_loan, np.full(len(holders), size))
+        self.outstanding = np.append(self.outstanding, np.full(len(holders), size))
+        self.repayment = np.append(
+            self.repayment, np.full(len(holders), self.monthly_cost[product]))
+
+    def keep(self, loans):
+        """ Keeps only the selected loans """
+        self.holder = self.holder[loans]
+        self.product = self.product[loans]
+        self.own_loan = self.own_loan[loans]
+        self.outstanding = self.outstanding[loans]
+        self.repayment = self.repayment[loans]
+
+    def write_off(self, holders):
+        """ Removes every loan of the given households """
+        self.keep(~np.isin(self.holder, holders))
+
+    def collect_repayments(self, model):
+        """
+        Collects one monthly repayment on every loan
+        Loans that are paid off are closed after their last repayment
+        """
+        interest = np.round(self.outstanding * self.monthly_rate[self.product], 3)
+        capital = np.round(self.repayment - interest, 3)
+        self.outstanding = np.maximum(np.round(self.outstanding - capital, 3), 0)
+
+        borrowers_interest_payments = self.per_household(interest).tolist()
+        capital_repayments = self.per_household(capital).tolist()
+        for household, borrowers_interest_payment, capital_repayment in zip(
+                model.households, borrowers_interest_payments, capital_repayments):
+            household.borrowers_interest_payment = borrowers_interest_payment
+            household.capital_repayment = capital_repayment
+        self.update_households(model)
+
+        self.keep(self.outstanding > 0)
+
+    def risk_weighted_exposure(self):
+        """ Outstanding lending weighted by the risk weight of each product """
+        return float(self.per_product(self.outstanding) @ self.risk_weight)
+
+    def new_risk_weight(self):
+        """ Risk weight of new lending, split between the products by their shares """
+        return float(self.share @ self.risk_weight / self.share.sum())
+
+    def lending_allowed(self, max_rwa):
+        """
+        Total lending that keeps the risk-weighted exposure within max_rwa,
+        with the loans in the book at their own risk weights and new lending
+        split between the products by their shares
+        """
+        return float(self.outstanding.sum()) + \
+            (max_rwa - self.risk_weighted_exposure()) / self.new_risk_weight()
+
+    def update_households(self, model):
+        """ Copies each household's totals over its loans to the household """
+        own_loans = self.per_household(self.own_loan).tolist()
+        outstanding = self.per_household(self.outstanding).tolist()
+        repayments = self.per_household(self.repayment).tolist()
+        for household, own_loan, own_outstanding_borrowing, monthly_repayment in zip(
+                model.households, own_loans, outstanding, repayments):
+            household.own_loan = own_loan
+            household.own_outstanding_borrowing = own_outstanding_borrowing
+            household.monthly_repayment = monthly_repayment
+
+
+def make_loans(model):
+    """
+    Lends the funds available for new loans, split between the products by
+    their shares
+    A household can hold one loan of each product. With the affordability
+    test half its budget has to cover its existing repayments and the new one
+    """
+    book = model.loan_book
+    potential_borrowers = np.zeros(book.num_households, dtype=bool)
+    model.num_loans = 0
+    model.num_new_borrowers = 0
+    model.total_new_loans = 0
+    for product in range(len(book.products)):
+        num_loans = math.floor(
+            model.new_loans_available * book.share[product] / book.loan_size[product])
+        eligible = ~book.holds()[:, product]
+        if model.affordability_test:
+            eligible &= (0.5 * book.budgets) >= (
+                book.per_household(book.repayment) + book.monthly_cost[product])
+        potential_borrowers |= eligible
+
+        household_potential_loan_takers = [model.households[count]
+                                           for count in np.flatnonzero(eligible)]
+        household_loan_takers = model.loan_market.draw_borrowers(
+            household_potential_loan_takers,
+            min(num_loans, len(household_potential_loan_takers)),
+            float(book.loan_size[product]))
+        book.originate([household.unique_id for household in household_loan_takers], product)
+
+        model.num_loans += num_loans
+        model.num_new_borrowers += len(household_loan_takers)
+        model.total_new_loans += len(household_loan_takers) * book.loan_size[product]
+
+    for count in np.flatnonzero(potential_borrowers):
+        model.households[count].potential_borrower = "Yes"
+    model.potential_borrowers = int(potential_borrowers.sum())
+    for household_loan_taker in model.loan_market.borrowers:
+        household_loan_taker.new_loan = "Yes"
+    book.update_households(model)
+
+    model.total_new_loans = float(model.total_new_loans)
+    model.new_loans_available = model.total_new_loans
+
+    # No lending
+    if model.num_loans == 0 and model.month_loans_stop == 0:
+        model.month_loans_stop = model.month_counter
@@ -0,0 +1,69 @@
+""" Loan Market
+
+Matches new loans with borrowers and sellers. Households that pass the
+affordability test are indexed once, when budgets are allocated, and each
+month the borrowers and the sellers their loans are spent with are drawn in
+one bulk draw each, rather than rebuilding candidate lists and drawing one
+seller per loan.
+"""
+import numpy as np
+import random_streams as rs
+
+
+def affordable_households(budgets, monthly_cost):
+    """
+    Marks the households whose budgets pass the affordability test
+    Budgets are fixed after setup, so they are sorted once and the cut-off
+    found by binary search. Works on the budgets of one population or on an
+    array shaped (replicates, households)
+    """
+    budgets = np.asarray(budgets)
+    rows = np.atleast_2d(budgets)
+    order = np.argsort(rows, axis=1, kind="stable")
+    half_budgets = 0.5 * np.take_along_axis(rows, order, axis=1)
+    cut_offs = np.array([np.searchsorted(row, monthly_cost) for row in half_budgets])
+    affordable = np.empty(rows.shape, dtype=bool)
+    np.put_along_axis(affordable, order,
+                      np.arange(rows.shape[1]) >= cut_offs[:, None], axis=1)
+    return affordable.reshape(budgets.shape)
+
+
+class LoanMarket:
+    """ Households eligible for loans and the borrowers of the current month """
+
+    def __init__(self, model):
+        self.households = model.households
+        # Budgets and the monthly cost are fixed after setup
+        # Mixed portfolios test affordability per product in the loan book
+        if model.affordability_test and model.loan_type != "mixed":
+            affordable = affordable_households(
+                [household.budget for household in model.households], model.monthly_cost)
+            self.affordable = [household for household, passed in
+                               zip(model.households, affordable) if passed]
+        else:
+            self.affordable = list(model.households)
+        self.borrowers = []
+        self.loans = []
+        self.borrower_random = rs.python_stream(model, "borrowers")
+        self.seller_random = rs.python_stream(model, "sellers")
+
+    def clear(self):
+        """ Forgets the loans of the previous month """
+        self.borrowers = []
+        self.loans = []
+
+    def potential_borrowers(self):
+        """ Intersects the affordable households with those without outstanding borrowing """
+        return [household for household in self.affordable
+                if household.own_outstanding_borrowing == 0]
+
+    def draw_borrowers(self, potential_borrowers, num_new_borrowers, loan_size):
+        """ Draws borrowers, without replacement, for num_new_borrowers loans of loan_size """
+        borrowers = self.borrower_random.sample(potential_borrowers, num_new_borrowers)
+        self.borrowers += borrowers
+        self.loans += [loan_size] * num_new_borrowers
+        return borrowers
+
+    def draw_sellers(self):
+        """ Draws one seller, from all households, for each of this month's loans """
+        return self.seller_random.choices(self.households, k=len(self.loans))
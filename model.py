@@ -1,11 +1,17 @@
 """ The Bank Run Model """
-import random
+import numpy as np
 from mesa import Agent, Model
 from mesa.time import BaseScheduler
 from mesa.space import ContinuousSpace
 from mesa.datacollection import DataCollector
 import banking_model_functions as bf
 import threshold_model_functions as tf
+import loan_market as lm
+import loan_book as lb
+import population_scaling as ps
+import trajectory_recorder as tr
+import withdrawal_engine as we
+import random_streams as rs
 
 
 class Households(Agent):
@@ -54,7 +60,7 @@ class Households(Agent):
         y_position = position[1]
 
         # Get a random integer between 0 and 8
-        test = random.randint(1, 8)
+        test = rs.python_stream(self.model, "shift").randint(1, 8)
 
         # If "test" is 1, decrease the "x" position by 1 unit
         # and increase the "y" position by 1 unit
@@ -142,7 +148,10 @@ class BankRunModel(Model):
                  shock_month=12, defaulters_percent=1, annual_savers_rate_percent=2,
                  target_capital_adequacy_ratio_percent=10, affordability_test=1,
                  bank_run=1, social_shifting=1, social_shift_percent=5, social_reach=30,
-                 innovators_percent=2.5, threshold="One-scattered", mean_threshold=50):
+                 innovators_percent=2.5, threshold="One-scattered", mean_threshold=50,
+                 trajectory_path=None, trajectory_months=120, loan_products=None,
+                 network_topology="radius", network_degree=10, network_rewire_percent=10,
+                 network_path=None, intra_month_withdrawals=0, common_random_numbers=0):
         super().__init__()
         self.num_households = num_households
         self.num_banks = 1
@@ -229,20 +238,32 @@ class BankRunModel(Model):
         self.liquidity_event = 0
         self.liquidity_event_month = 0
 
+        # Withdrawals spread over the month, when intra_month_withdrawals is on
+        self.intra_month_withdrawals = intra_month_withdrawals
+        self.liquidity_event_day = np.nan
+        self.liquidity_event_household = -1
+        self.liquidity_path = np.zeros(we.DAYS_PER_MONTH, dtype=np.float32)
+        # Paths of the months withdrawals were timed in, and those months
+        self.liquidity_paths = []
+        self.liquidity_path_months = []
+
+        # One substream per random event, when common_random_numbers is on
+        self.common_random_numbers = common_random_numbers
+        self.random_streams = rs.make_streams(self)
+
         # This ensures density of agents is 1%
-        if self.num_households == 1000:
-            self.space_size = 316
-        elif self.num_households == 5000:
-            self.space_size = 706
-        else:
-            self.space_size = 1000
+        self.space_size = ps.space_size(self.num_households)
 
         # From threshold model
         self.count_of_innovators = 0
         self.households_listed_by_threshold = 0
+        self.my_thresholds = None
         self.min_circle_size = 0
         self.av_circle_size = 0
         self.max_circle_size = 0
+        self.circles = None
+        self.loan_market = None
+        self.loan_book = None
         self.n_with_no_circle = 0
         self.n_of_shifters = 0
         self.adopters_percent = 0
@@ -258,9 +279,12 @@ class BankRunModel(Model):
         self.innovators_percent = innovators_percent
         self.threshold = threshold
         self.mean_threshold = mean_threshold
+        self.network_topology = network_topology
+        self.network_degree = network_degree
+        self.network_rewire_percent = network_rewire_percent
+        self.network_path = network_path
 
-        # Based on a total population of 1000
-        self.n_of_innovators = int(self.innovators_percent*10)
+        self.n_of_innovators = ps.count_of_percent(self.innovators_percent, self.num_households)
 
         # Continuous space
         self.space = ContinuousSpace(self.space_size, self.space_size, True)
@@ -276,7 +300,15 @@ class BankRunModel(Model):
             self.loan_size = 100
             self.risk_weight_loan_percent = self.risk_weight_mortgages_percent
 
-        if self.monthly_loan_rate > 0:
+        # Mixed portfolios hold every product in a loan book, which sets the
+        # size, term, cost, risk weight and affordability of each product's
+        # loans; no single loan stands for them
+        if self.loan_type == "mixed":
+            self.loan_products = lb.make_products(annual_loan_rate_percent, loan_products)
+            self.loan_term_months = None
+            self.loan_size = None
+            self.monthly_cost = None
+        elif self.monthly_loan_rate > 0:
             self.monthly_cost = round((self.loan_size*self.monthly_loan_rate) /
                                       (1 - ((1 + self.monthly_loan_rate)
                                             ** (-self.loan_term_months))), 3)
@@ -287,16 +319,25 @@ class BankRunModel(Model):
         self.schedule = BaseScheduler(self)
         self.running = True
 
+        # Optional per-household trajectories, written to a memory-mapped file
+        self.trajectory_recorder = None
+        if trajectory_path is not None:
+            self.trajectory_recorder = tr.TrajectoryRecorder(
+                trajectory_path, self.num_households, trajectory_months)
+
         # Used to store agents
         self.households = []
         self.banks = []
 
         # Create households
+        positions = self.random
+        if self.random_streams is not None:
+            positions = self.random_streams.python("positions")
         for count_households in range(self.num_households):
             household = Households(count_households, self)
             self.schedule.add(household)
-            self.space.place_agent(household, (self.random.randrange(
-                self.space_size), self.random.randrange(self.space_size)))
+            self.space.place_agent(household, (positions.randrange(
+                self.space_size), positions.randrange(self.space_size)))
             self.households.append(household)
 
         # Create bank
@@ -306,49 +347,59 @@ class BankRunModel(Model):
             self.banks.append(bank)
 
         # Data collector
-        self.datacollector = DataCollector(
-            model_reporters={"Month": lambda a: a.month_counter,
-                             "Cap_Ad":
-                             lambda a: a.capital_adequacy_ratio_percent,
-                             "Reserve": lambda a: a.reserve_ratio_percent,
-                             "Capital": lambda a: a.total_capital_at_end_of_month / 1000,
-                             "Deposits": lambda a: a.total_deposits_at_end_of_month / 1000,
-                             "Profits": lambda a: a.total_retained_profit / 1000,
-                             "Liabilities": lambda a: a.total_liabilities_at_end_of_month / 1000,
-                             "Liquid": lambda a: a.total_banks_liquidity / 1000,
-                             "Lending": lambda a: a.total_lending_at_end_of_month / 1000,
-                             "Assets": lambda a: a.total_assets_at_end_of_month / 1000,
-                             "Balance": lambda a: a.overall_balance_at_end_of_month / 1000,
-                             "Multiplier": lambda a: a.bank_deposit_multiplier,
-                             "Car_Constraint_Indicator": lambda a: a.car_constraint_indicator,
-                             "Borrowers": lambda a: a.count_borrowers,
-                             "Savers": lambda a: a.count_savers,
-                             "Pot_Borrow": lambda a: a.count_potential_borrowers,
-                             "Def": lambda a: a.count_defaulters,
-                             "Loans": lambda a: a.loan_size,
-                             "Borrowings": lambda a: a.average_amount_borrowed,
-                             "Savings": lambda a: a.average_amount_saved,
-                             "Borrowers_Interest_Payments":
-                             lambda a: a.total_borrowers_interest_payments,
-                             "Liquid_Asset_Income": lambda a: a.income_on_liquid_assets,
-                             "Savers_Interest_Payments": lambda a: a.total_savers_interest_payments,
-                             "Bad_Debts": lambda a: a.total_bad_debts,
-                             "Current_Profit": lambda a: a.total_current_profit,
-                             "Deposits_at_Start_of_Month":
-                             lambda a: a.total_deposits_at_start_of_month,
-                             "Required_Liquidity": lambda a: a.total_banks_required_liquidity,
-                             "Lending_at_Start_of_Month":
-                             lambda a: a.total_lending_at_start_of_month,
-                             "New_Loans_Supply": lambda a: a.new_loan_supply,
-                             "New_Loans_Made": lambda a: a.total_new_loans,
-                             "Capital_Repayments": lambda a: a.total_capital_repayments,
-                             "Total_Repayments": lambda a: a.total_repayments,
-                             "Total_Expenditure": lambda a: a.total_expenditure,
-                             "RWE": lambda a: a.total_risk_weighted_exposure,
-                             "adopters_percent": lambda a: a.adopters_percent,
-                             "Liquid_Assets": lambda a: a.bank_liquid_assets,
-                             "liquidity_event": lambda a: a.liquidity_event,
-                             "liquidity_event_month": lambda a: a.liquidity_event_month})
+        model_reporters = {"Month": lambda a: a.month_counter,
+                           "Cap_Ad":
+                           lambda a: a.capital_adequacy_ratio_percent,
+                           "Reserve": lambda a: a.reserve_ratio_percent,
+                           "Capital": lambda a: a.total_capital_at_end_of_month / 1000,
+                           "Deposits": lambda a: a.total_deposits_at_end_of_month / 1000,
+                           "Profits": lambda a: a.total_retained_profit / 1000,
+                           "Liabilities": lambda a: a.total_liabilities_at_end_of_month / 1000,
+                           "Liquid": lambda a: a.total_banks_liquidity / 1000,
+                           "Lending": lambda a: a.total_lending_at_end_of_month / 1000,
+                           "Assets": lambda a: a.total_assets_at_end_of_month / 1000,
+                           "Balance": lambda a: a.overall_balance_at_end_of_month / 1000,
+                           "Multiplier": lambda a: a.bank_deposit_multiplier,
+                           "Car_Constraint_Indicator": lambda a: a.car_constraint_indicator,
+                           "Borrowers": lambda a: a.count_borrowers,
+                           "Savers": lambda a: a.count_savers,
+                           "Pot_Borrow": lambda a: a.count_potential_borrowers,
+                           "Def": lambda a: a.count_defaulters,
+                           "Loans": lambda a: a.loan_size,
+                           "Borrowings": lambda a: a.average_amount_borrowed,
+                           "Savings": lambda a: a.average_amount_saved,
+                           "Borrowers_Interest_Payments":
+                           lambda a: a.total_borrowers_interest_payments,
+                           "Liquid_Asset_Income": lambda a: a.income_on_liquid_assets,
+                           "Savers_Interest_Payments": lambda a: a.total_savers_interest_payments,
+                           "Bad_Debts": lambda a: a.total_bad_debts,
+                           "Current_Profit": lambda a: a.total_current_profit,
+                           "Deposits_at_Start_of_Month":
+                           lambda a: a.total_deposits_at_start_of_month,
+                           "Required_Liquidity": lambda a: a.total_banks_required_liquidity,
+                           "Lending_at_Start_of_Month":
+                           lambda a: a.total_lending_at_start_of_month,
+                           "New_Loans_Supply": lambda a: a.new_loan_supply,
+                           "New_Loans_Made": lambda a: a.total_new_loans,
+                           "Capital_Repayments": lambda a: a.total_capital_repayments,
+                           "Total_Repayments": lambda a: a.total_repayments,
+                           "Total_Expenditure": lambda a: a.total_expenditure,
+                           "RWE": lambda a: a.total_risk_weighted_exposure,
+                           "adopters_percent": lambda a: a.adopters_percent,
+                           "Liquid_Assets": lambda a: a.bank_liquid_assets,
+                           "liquidity_event": lambda a: a.liquidity_event,
+                           "liquidity_event_month": lambda a: a.liquidity_event_month}
+        if self.intra_month_withdrawals:
+            model_reporters["liquidity_event_day"] = lambda a: a.liquidity_event_day
+            model_reporters["liquidity_event_household"] = \
+                lambda a: a.liquidity_event_household
+        if self.loan_type == "mixed":
+            # Each product reports its own loan size rather than the average
+            del model_reporters["Loans"]
+            for product in self.loan_products:
+                model_reporters["Loans_" + product["name"]] = \
+                    lambda a, loan_size=product["loan_size"]: loan_size
+        self.datacollector = DataCollector(model_reporters=model_reporters)
 
     def step(self):
         """ Advance the model by one step """
@@ -362,6 +413,11 @@ class BankRunModel(Model):
             # Determine savers
             bf.determine_savers(self)
 
+            # Index households eligible for loans
+            self.loan_market = lm.LoanMarket(self)
+            if self.loan_type == "mixed":
+                self.loan_book = lb.LoanBook(self)
+
             if self.bank_run:  # Bank run is on
                 # Create social circles
                 tf.create_circles(self)
@@ -419,6 +475,15 @@ class BankRunModel(Model):
 
         # Collect data
         self.datacollector.collect(self)
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(self)
+            if self.trajectory_recorder.full():
+                self.trajectory_recorder.close()
 
         # Advance the model by one step
         self.schedule.step()
+
+    def close(self):
+        """ Closes the trajectory recorder, keeping only the months recorded """
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.close()
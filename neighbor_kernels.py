@@ -0,0 +1,149 @@
+""" Neighbor Kernels
+
+Kernels for finding the households within social reach of each other on the
+torus and counting their adopting neighbors. A Numba-compiled cell-list
+backend is used when Numba is installed, otherwise a pure-NumPy backend.
+"""
+from importlib.util import find_spec
+import numpy as np
+
+BACKEND = "numba" if find_spec("numba") is not None else "numpy"
+
+
+def grid_cells(points, space_size, radius):
+    """
+    Assigns points to square cells at least radius wide
+    Returns the number of cells per side and each point's cell coordinates
+    """
+    cells_per_side = max(1, int(space_size // radius)) if radius > 0 else 1
+    cell_width = space_size / cells_per_side
+    cells = np.minimum((points // cell_width).astype(np.int64),
+                       cells_per_side - 1)
+    return cells_per_side, cells
+
+
+def cell_list(points, space_size, radius):
+    """
+    Sorts points into cells at least radius wide
+    Returns the cells per side, each point's cell coordinates, the point
+    order by cell, where each cell starts in that order and the offsets of
+    the neighboring cells
+    """
+    cells_per_side, cells = grid_cells(points, space_size, radius)
+    cell_ids = cells[:, 0] * cells_per_side + cells[:, 1]
+    order = np.argsort(cell_ids, kind="stable")
+    cell_start = np.searchsorted(
+        cell_ids[order], np.arange(cells_per_side ** 2 + 1))
+
+    # Visit each neighboring cell once, even when the grid is too small for
+    # the 3 x 3 block around a cell to wrap onto distinct cells
+    offsets = np.unique([((dx % cells_per_side), (dy % cells_per_side))
+                         for dx in (-1, 0, 1) for dy in (-1, 0, 1)], axis=0)
+    return cells_per_side, cells, order, cell_start, offsets
+
+
+def radius_graph_numpy(points, space_size, radius):
+    """ Cell-list radius graph with NumPy """
+    num_points = len(points)
+    cells_per_side, cells, order, cell_start, offsets = cell_list(
+        points, space_size, radius)
+    rows = []
+    cols = []
+    for offset_x, offset_y in offsets:
+        other_cells = ((cells[:, 0] + offset_x) % cells_per_side) * cells_per_side + \
+            (cells[:, 1] + offset_y) % cells_per_side
+        starts = cell_start[other_cells]
+        counts = cell_start[other_cells + 1] - starts
+        candidate_rows = np.repeat(np.arange(num_points), counts)
+        firsts = np.repeat(np.cumsum(counts) - counts, counts)
+        candidate_cols = order[np.repeat(starts, counts) +
+                               np.arange(counts.sum()) - firsts]
+        rows.append(candidate_rows)
+        cols.append(candidate_cols)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    deltas = np.abs(points[rows] - points[cols])
+    deltas = np.minimum(deltas, space_size - deltas)
+    dists = deltas[:, 0] ** 2 + deltas[:, 1] ** 2
+    keep = (dists <= radius ** 2) & (rows != cols)
+    rows = rows[keep]
+    cols = cols[keep]
+    dists = dists[keep]
+
+    edges = np.lexsort((cols, rows))
+    indptr = np.zeros(num_points + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_points), out=indptr[1:])
+    return indptr, cols[edges], dists[edges] > 0
+
+
+def edge_rows(indptr):
+    """ Row index of every entry of a CSR graph """
+    return np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+
+def count_neighbors_numpy(graph, flags, include_center):
+    """ Counts flagged neighbors with NumPy """
+    indptr, indices, far = graph
+    weights = np.asarray(flags, dtype=bool)[indices]
+    if not include_center:
+        weights &= far
+    return np.bincount(edge_rows(indptr), weights=weights,
+                       minlength=len(indptr) - 1).astype(np.int64)
+
+
+def radius_graph(points, space_size, radius, backend=None):
+    """
+    Neighbors within radius of each point on a torus, as CSR arrays
+    (indptr, indices, far), where far marks neighbors at a non-zero distance
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if (backend or BACKEND) == "numba":
+        import neighbor_kernels_numba
+        return neighbor_kernels_numba.radius_graph(points, space_size, radius)
+    return radius_graph_numpy(points, space_size, radius)
+
+
+def count_neighbors(graph, flags, include_center, backend=None):
+    """
+    Counts the flagged neighbors of each point
+    include_center also counts neighbors at exactly the same position
+    """
+    if (backend or BACKEND) == "numba":
+        import neighbor_kernels_numba
+        return neighbor_kernels_numba.count_neighbors(graph, flags, include_center)
+    return count_neighbors_numpy(graph, flags, include_center)
+
+
+def circle_sizes(graph):
+    """ Number of neighbors of each point at a non-zero distance """
+    indptr, _, far = graph
+    return np.bincount(edge_rows(indptr)[far], minlength=len(indptr) - 1)
+
+
+def check_parity(model, backend=None):
+    """
+    Checks the kernels against the reference Mesa neighbor queries for the
+    current positions and adoption state of a BankRunModel
+    Returns True when circle sizes and adopting-friend counts all match
+    """
+    points = [household.pos for household in model.households]
+    graph = radius_graph(points, model.space_size, model.social_reach, backend)
+    adopted = [household.adoption == "yes" for household in model.households]
+    sizes = circle_sizes(graph)
+    adopting = count_neighbors(graph, adopted, True, backend)
+    adopting_far = count_neighbors(graph, adopted, False, backend)
+
+    for index, household in enumerate(model.households):
+        neighbors = model.space.get_neighbors(
+            household.pos, model.social_reach, False)
+        neighbors_with_center = model.space.get_neighbors(
+            household.pos, model.social_reach, True)
+        if len(neighbors) != sizes[index]:
+            return False
+        if sum(neighbor.adoption == "yes" for neighbor in neighbors) != adopting_far[index]:
+            return False
+        if sum(neighbor.adoption == "yes" for neighbor in neighbors_with_center
+               if neighbor is not household) != adopting[index]:
+            return False
+    return True
@@ -0,0 +1,81 @@
+""" Neighbor Kernels - Numba backend
+
+Compiled versions of the cell-list kernels in neighbor_kernels. Imported on
+first use so that Numba is only loaded by processes that build circles.
+"""
+import numba
+import numpy as np
+import neighbor_kernels as nk
+
+
+@numba.njit(cache=True)
+def radius_graph_kernel(points, space_size, radius, cells_per_side, cells,
+                        order, cell_start, offsets, indptr, indices, far):
+    """ Counts the neighbors of each point, or fills them in once counted """
+    # Counts neighbors when indices is empty, otherwise fills them in
+    # Candidates are read from a copy of the points sorted by cell, so the
+    # points of each cell are contiguous in memory
+    radius_squared = radius ** 2
+    filling = len(indices) > 0
+    points_by_cell = points[order]
+    for point in range(len(points)):
+        fill = indptr[point] if filling else 0
+        for offset in range(len(offsets)):
+            other_x = (cells[point, 0] + offsets[offset, 0]) % cells_per_side
+            other_y = (cells[point, 1] + offsets[offset, 1]) % cells_per_side
+            other_cell = other_x * cells_per_side + other_y
+            for position in range(cell_start[other_cell], cell_start[other_cell + 1]):
+                other = order[position]
+                if other == point:
+                    continue
+                delta_x = abs(points[point, 0] - points_by_cell[position, 0])
+                delta_y = abs(points[point, 1] - points_by_cell[position, 1])
+                delta_x = min(delta_x, space_size - delta_x)
+                delta_y = min(delta_y, space_size - delta_y)
+                dist = delta_x ** 2 + delta_y ** 2
+                if dist <= radius_squared:
+                    if filling:
+                        # Packs far into the lowest bit so one sort orders both
+                        indices[fill] = 2 * other + (dist > 0)
+                    fill += 1
+        if not filling:
+            indptr[point + 1] = fill
+        else:
+            neighbors = indices[indptr[point]:fill]
+            neighbors.sort()
+            far[indptr[point]:fill] = (neighbors & 1) == 1
+            neighbors >>= 1
+
+
+def radius_graph(points, space_size, radius):
+    """ Cell-list radius graph compiled with Numba """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    arguments = (points, float(space_size), float(radius)) + \
+        nk.cell_list(points, space_size, radius)
+    degree = np.zeros(len(points) + 1, dtype=np.int64)
+    radius_graph_kernel(*arguments, degree, np.zeros(0, dtype=np.int64),
+                        np.zeros(0, dtype=np.bool_))
+    indptr = np.cumsum(degree)
+    indices = np.empty(indptr[-1], dtype=np.int64)
+    far = np.empty(indptr[-1], dtype=np.bool_)
+    if len(indices) > 0:
+        radius_graph_kernel(*arguments, indptr, indices, far)
+    return indptr, indices, far
+
+
+@numba.njit(cache=True)
+def count_neighbors_kernel(indptr, indices, far, flags, include_center):
+    """ Counts the flagged neighbors of each point """
+    counts = np.zeros(len(indptr) - 1, dtype=np.int64)
+    for point in range(len(indptr) - 1):
+        for position in range(indptr[point], indptr[point + 1]):
+            if flags[indices[position]] and (include_center or far[position]):
+                counts[point] += 1
+    return counts
+
+
+def count_neighbors(graph, flags, include_center):
+    """ Counts flagged neighbors with Numba """
+    indptr, indices, far = graph
+    return count_neighbors_kernel(indptr, indices, far,
+                                  np.asarray(flags, dtype=np.bool_), include_center)
@@ -0,0 +1,144 @@
+""" Network Topology
+
+Generators for the household influence graph. Every generator returns CSR
+arrays (indptr, indices, far), the same layout as the radius graph of the
+neighbor kernels, so the threshold spread functions work on any of them.
+far marks neighbors at a non-zero distance; every neighbor is far in graphs
+that do not come from positions.
+
+Topologies:
+    radius       households within social_reach on the torus
+    k-nearest    each household's network_degree nearest households
+    small-world  a ring of network_degree neighbors with network_rewire_percent
+                 of the links rewired at random
+    scale-free   preferential attachment, network_degree / 2 links per household
+    edge-list    links read from the whitespace-separated file network_path
+"""
+import numpy as np
+import neighbor_kernels as nk
+
+TOPOLOGIES = ("radius", "k-nearest", "small-world", "scale-free", "edge-list")
+
+# Topologies built from positions, which change when households shift
+SPATIAL_TOPOLOGIES = ("radius", "k-nearest")
+
+
+def from_edges(num_nodes, rows, cols, far=None):
+    """
+    Builds CSR arrays from directed edges
+    Self-loops and repeated edges are dropped
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    far = np.ones(len(rows), dtype=bool) if far is None else np.asarray(far, dtype=bool)
+    keep = rows != cols
+    rows, cols, far = rows[keep], cols[keep], far[keep]
+
+    edges = np.lexsort((cols, rows))
+    rows, cols, far = rows[edges], cols[edges], far[edges]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols, far = rows[first], cols[first], far[first]
+
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+    return indptr, cols, far
+
+
+def undirected(num_nodes, rows, cols):
+    """ Builds CSR arrays with every edge in both directions """
+    return from_edges(num_nodes, np.concatenate([rows, cols]), np.concatenate([cols, rows]))
+
+
+def radius(points, space_size, social_reach):
+    """ Households within social_reach of each other on the torus """
+    return nk.radius_graph(points, space_size, social_reach)
+
+
+def k_nearest(points, space_size, degree):
+    """
+    Each household's degree nearest households on the torus
+    Candidates come from a radius graph, widened until every household has
+    enough of them
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    num_points = len(points)
+    degree = min(degree, num_points - 1)
+    density = num_points / space_size ** 2
+    reach = 1.5 * np.sqrt(degree / (np.pi * density))
+    while True:
+        indptr, indices, _ = nk.radius_graph(points, space_size, reach)
+        if np.diff(indptr).min(initial=degree) >= degree or reach >= space_size:
+            break
+        reach *= 1.5
+
+    rows = nk.edge_rows(indptr)
+    deltas = np.abs(points[rows] - points[indices])
+    deltas = np.minimum(deltas, space_size - deltas)
+    dists = deltas[:, 0] ** 2 + deltas[:, 1] ** 2
+    edges = np.lexsort((dists, rows))
+    rank = np.arange(len(edges)) - indptr[rows]
+    nearest = edges[rank < degree]
+    return from_edges(num_points, rows[nearest], indices[nearest], dists[nearest] > 0)
+
+
+def small_world(num_nodes, degree, rewire_percent, rng=np.random):
+    """
+    Watts-Strogatz graph: a ring where each household links to degree / 2
+    neighbors on either side, with rewire_percent of the links moved to a
+    household drawn at random
+    """
+    half_degree = max(1, degree // 2)
+    rows = np.repeat(np.arange(num_nodes), half_degree)
+    cols = (rows + np.tile(np.arange(1, half_degree + 1), num_nodes)) % num_nodes
+    rewired = rng.random(len(rows)) < rewire_percent / 100
+    cols[rewired] = np.floor(rng.random(rewired.sum()) * num_nodes).astype(np.int64)
+    return undirected(num_nodes, rows, cols)
+
+
+def scale_free(num_nodes, degree, rng=np.random):
+    """
+    Barabasi-Albert graph: each household links to degree / 2 earlier
+    households, chosen in proportion to their links so far
+    Drawing from the list of link ends is the same as drawing by degree
+    """
+    links = max(1, degree // 2)
+    ends = [0] * (2 * num_nodes * links)
+    draws = rng.random(num_nodes * links).tolist()
+    for link, draw in enumerate(draws):
+        ends[2 * link] = link // links
+        ends[2 * link + 1] = ends[int(draw * (2 * link + 1))]
+    ends = np.array(ends, dtype=np.int64)
+    return undirected(num_nodes, ends[0::2], ends[1::2])
+
+
+def edge_list(num_nodes, path, directed=False):
+    """
+    Links read from a file with a source and a target household per line
+    Lines starting with # are comments
+    """
+    edges = np.loadtxt(path, dtype=np.int64, ndmin=2, comments="#")
+    invalid = edges[(edges < 0) | (edges >= num_nodes)]
+    if len(invalid) > 0:
+        raise ValueError(f"Edge list {path} links household {invalid[0]}, but household ids "
+                         f"must be from 0 to {num_nodes - 1}")
+    if directed:
+        return from_edges(num_nodes, edges[:, 0], edges[:, 1])
+    return undirected(num_nodes, edges[:, 0], edges[:, 1])
+
+
+def make_graph(model, points, rng=np.random):
+    """ Builds the influence graph chosen by model.network_topology """
+    if model.network_topology == "radius":
+        return radius(points, model.space_size, model.social_reach)
+    if model.network_topology == "k-nearest":
+        return k_nearest(points, model.space_size, model.network_degree)
+    if model.network_topology == "small-world":
+        return small_world(model.num_households, model.network_degree,
+                           model.network_rewire_percent, rng)
+    if model.network_topology == "scale-free":
+        return scale_free(model.num_households, model.network_degree, rng)
+    if model.network_topology == "edge-list":
+        return edge_list(model.num_households, model.network_path)
+    raise ValueError("Unknown network topology " + repr(model.network_topology) +
+                     "; choose one of " + ", ".join(TOPOLOGIES))
@@ -0,0 +1,28 @@
+""" Population Scaling
+
+Sizes that depend on the number of households. The model was written for
+1000 households; these keep the density of households in the space and
+the counts given as percentages of the population right for any number
+of households, and give the same values as before for 1000 households.
+"""
+import math
+
+# Space sizes of the published runs
+PUBLISHED_SPACE_SIZES = {1000: 316, 5000: 706}
+
+
+def space_size(num_households):
+    """ Side of the space that keeps the density of households at 1% """
+    if num_households in PUBLISHED_SPACE_SIZES:
+        return PUBLISHED_SPACE_SIZES[num_households]
+    return int(math.sqrt(num_households * 100))
+
+
+def households_per_percent(num_households):
+    """ Number of households making up 1% of the population """
+    return num_households / 100
+
+
+def count_of_percent(percent, num_households):
+    """ Number of households making up percent of the population """
+    return int(percent * households_per_percent(num_households))
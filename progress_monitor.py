@@ -0,0 +1,157 @@
+""" Progress Monitor
+
+Progress of a sweep, published as JSON lines appended to a file, and a small
+viewer that follows the file. Events are buffered and written in batches by
+the process that collects the results, so publishing never waits on the
+worker processes and the workers never wait on the publisher.
+
+Watching a sweep:
+    python headless_runner.py --iterations 10000 --progress progress.jsonl ...
+    python progress_monitor.py progress.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+class ProgressPublisher:
+    """
+    Appends progress events to a JSON lines file
+    Events are written once batch_size of them are waiting or flush_seconds
+    have passed since the last write
+    """
+
+    def __init__(self, path, batch_size=50, flush_seconds=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.events = []
+        self.last_flush = time.time()
+        self.file = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def publish(self, event, **fields):
+        """ Queues an event and writes the queue if it is due """
+        fields["event"] = event
+        fields["time"] = time.time()
+        self.events.append(fields)
+        if len(self.events) >= self.batch_size or \
+                fields["time"] - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """ Writes every queued event in one append """
+        if self.events:
+            os.write(self.file, "".join(
+                json.dumps(event) + "\n" for event in self.events).encode())
+            self.events = []
+        self.last_flush = time.time()
+
+    def close(self):
+        """ Writes the remaining events and closes the file """
+        self.flush()
+        os.close(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_events(path, position=0):
+    """
+    Reads the complete events written after position
+    Returns the events and the position to read from next time
+    """
+    with open(path, "rb") as progress_file:
+        progress_file.seek(position)
+        data = progress_file.read()
+    complete = data.rfind(b"\n") + 1
+    events = [json.loads(line) for line in data[:complete].splitlines() if line]
+    return events, position + complete
+
+
+def summarize(events):
+    """
+    Summarizes the progress of the latest sweep in a list of events
+    Returns runs finished, total runs, runs per second, the liquidity event
+    rate overall and per scenario, and the mean seconds of each phase
+    """
+    starts = [count for count, event in enumerate(events) if event["event"] == "start"]
+    if starts:
+        events = events[starts[-1]:]
+    start = events[0] if events and events[0]["event"] == "start" else {}
+    blocks = [event for event in events if event["event"] == "block"]
+
+    runs = sum(block["runs"] for block in blocks)
+    liquidity_events = sum(block["liquidity_events"] for block in blocks)
+    elapsed = (blocks[-1]["time"] - start["time"]) if blocks and start else 0
+
+    scenarios = {}
+    for block in blocks:
+        scenario = scenarios.setdefault(block["scenario"], {
+            "parameters": block["parameters"], "runs": 0, "liquidity_events": 0})
+        scenario["runs"] += block["runs"]
+        scenario["liquidity_events"] += block["liquidity_events"]
+    for scenario in scenarios.values():
+        scenario["liquidity_event_rate"] = scenario["liquidity_events"] / scenario["runs"]
+
+    phases = {}
+    for block in blocks:
+        for phase, seconds in block["timings"].items():
+            phases.setdefault(phase, []).append(seconds)
+
+    return {"runs": runs,
+            "total_runs": start.get("total_runs", runs),
+            "runs_per_second": runs / elapsed if elapsed > 0 else 0,
+            "liquidity_event_rate": liquidity_events / runs if runs else 0,
+            "scenarios": scenarios,
+            "phase_seconds": {phase: sum(seconds) / len(seconds)
+                              for phase, seconds in phases.items()},
+            "finished": any(event["event"] == "finish" for event in events)}
+
+
+def format_summary(summary):
+    """ Formats a summary as lines of text """
+    lines = [f"runs {summary['runs']}/{summary['total_runs']}  "
+             f"{summary['runs_per_second']:.1f} runs/sec  "
+             f"liquidity events {summary['liquidity_event_rate']:.1%}"]
+    for number, scenario in sorted(summary["scenarios"].items()):
+        lines.append(f"  scenario {number}: {scenario['runs']} runs, "
+                     f"liquidity events {scenario['liquidity_event_rate']:.1%}  "
+                     f"{json.dumps(scenario['parameters'])}")
+    if summary["phase_seconds"]:
+        lines.append("  phases per block: " + ", ".join(
+            f"{phase} {seconds:.2f}s" for phase, seconds in summary["phase_seconds"].items()))
+    return lines
+
+
+def watch(path, refresh_seconds=1.0, output=sys.stdout):
+    """ Follows a progress file and prints a summary until the sweep finishes """
+    events = []
+    position = 0
+    while True:
+        if os.path.exists(path):
+            new_events, position = read_events(path, position)
+            events += new_events
+        summary = summarize(events)
+        output.write("\n".join(format_summary(summary)) + "\n\n")
+        output.flush()
+        if summary["finished"]:
+            return summary
+        time.sleep(refresh_seconds)
+
+
+def main():
+    """ Watches a progress file from the command line """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="Progress file written by headless_runner.py --progress")
+    parser.add_argument("--refresh", type=float, default=1.0, help="Seconds between updates")
+    arguments = parser.parse_args()
+    watch(arguments.path, arguments.refresh)
+
+
+if __name__ == "__main__":
+    main()
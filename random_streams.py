@@ -0,0 +1,173 @@
+""" Random Streams
+
+Common random numbers for paired scenarios. Each logical random event of
+the model draws from its own substream of one seed, so two scenarios run
+with the same seed see the same budgets, savers, thresholds and so on
+wherever their logic coincides, and a change in one event does not shift
+the draws of every later one. Differences between paired scenarios then
+need far fewer replicates for the same precision.
+
+In an ensemble every replicate has its own substreams, so the draws of one
+replicate do not depend on how many others are still running.
+
+Without common random numbers the functions below return the generators
+the models have always used, so seeded runs are unchanged.
+"""
+import copy
+import random
+import numpy as np
+
+# Random events of the model, each with its own substream
+# New streams go at the end, so existing streams keep their draws
+STREAMS = ("positions", "budget", "savers", "defaulters", "borrowers", "sellers",
+           "withdrawals", "network", "innovators", "thresholds", "spread", "shift")
+
+
+class RandomStreams:
+    """ One NumPy generator and one random.Random per stream, all from one seed """
+
+    def __init__(self, seed=None):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.generators = {}
+        self.python_generators = {}
+
+    def seed_of(self, name):
+        """ Seed sequence of a stream, fixed by the seed and the stream's name """
+        return np.random.SeedSequence(
+            self.seed_sequence.entropy,
+            spawn_key=self.seed_sequence.spawn_key + (STREAMS.index(name),))
+
+    def numpy(self, name):
+        """ NumPy generator of a stream """
+        if name not in self.generators:
+            self.generators[name] = np.random.default_rng(self.seed_of(name))
+        return self.generators[name]
+
+    def python(self, name):
+        """ random.Random of a stream, for code written against the random module """
+        if name not in self.python_generators:
+            self.python_generators[name] = random.Random(
+                int(self.seed_of(name).generate_state(1, np.uint64)[0]))
+        return self.python_generators[name]
+
+
+class ReplicateGenerator:
+    """
+    Draws arrays shaped (replicates, ...) one row per replicate, each row from
+    that replicate's own generator
+    """
+
+    def __init__(self, generators):
+        self.generators = generators
+
+    def draw(self, method, *args, size):
+        """ Calls method of every replicate's generator for its own row """
+        return np.stack([getattr(generator, method)(*args, size=size[1:])
+                         for generator in self.generators])
+
+    def random(self, size):
+        """ Uniform draws on [0, 1), one row per replicate """
+        return self.draw("random", size=size)
+
+    def integers(self, low, high, size):
+        """ Integers from low up to high, one row per replicate """
+        return self.draw("integers", low, high, size=size)
+
+    def uniform(self, low, high, size):
+        """ Uniform draws between low and high, one row per replicate """
+        return self.draw("uniform", low, high, size=size)
+
+    def normal(self, loc, scale, size):
+        """ Normal draws, one row per replicate """
+        return self.draw("normal", loc, scale, size=size)
+
+    def exponential(self, scale, size):
+        """ Exponential draws, one row per replicate """
+        return self.draw("exponential", scale, size=size)
+
+
+class ReplicateStreams:
+    """ Streams of each replicate of an ensemble, from seeds spawned per replicate """
+
+    def __init__(self, seed=None, num_replicates=1):
+        if isinstance(seed, np.random.SeedSequence):
+            # Spawn from a copy, leaving the caller's seed sequence as it was
+            seed = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key)
+        else:
+            seed = np.random.SeedSequence(seed)
+        self.replicates = [RandomStreams(replicate_seed)
+                           for replicate_seed in seed.spawn(num_replicates)]
+
+    def numpy(self, name):
+        """ Generator drawing each replicate's row from its own stream """
+        return ReplicateGenerator([streams.numpy(name) for streams in self.replicates])
+
+    def select(self, replicates):
+        """ Streams of the given replicates, which go on drawing where they were """
+        subset = copy.copy(self)
+        subset.replicates = [self.replicates[replicate] for replicate in replicates]
+        return subset
+
+
+def make_streams(model, seed=None):
+    """
+    Streams of a model run with common random numbers, or None without
+    A reference model seeds its streams from the random module, so runs
+    seeded with random.seed stay reproducible
+    """
+    if not model.common_random_numbers:
+        return None
+    if seed is None:
+        seed = random.getrandbits(128)
+    return RandomStreams(seed)
+
+
+def make_replicate_streams(model, seed=None):
+    """ Streams of every replicate of an ensemble with common random numbers, or None without """
+    if not model.common_random_numbers:
+        return None
+    return ReplicateStreams(seed, model.num_replicates)
+
+
+def python_stream(model, name):
+    """ random.Random of a stream, or the random module without common random numbers """
+    if model.random_streams is None:
+        return random
+    return model.random_streams.python(name)
+
+
+def numpy_stream(model, name):
+    """
+    NumPy generator of a stream, or without common random numbers the
+    model's own generator, or NumPy's global one when it has none
+    """
+    if model.random_streams is None:
+        return getattr(model, "rng", np.random)
+    return model.random_streams.numpy(name)
+
+
+def replicate_stream(model, name, replicate):
+    """
+    NumPy generator of a stream for one replicate of an ensemble, or the
+    ensemble's own generator without common random numbers
+    """
+    if model.random_streams is None:
+        return model.rng
+    return model.random_streams.replicates[replicate].numpy(name)
+
+
+def row_integers(rng, low, high, counts):
+    """
+    counts[r] random integers in row r, padded to the widest row
+    A replicate's stream draws only its own row, so the draws of one
+    replicate do not depend on the counts of the others
+    """
+    width = np.max(counts, initial=0)
+    if not isinstance(rng, ReplicateGenerator):
+        return rng.integers(low, high, size=(len(counts), width))
+    rows = np.zeros((len(counts), width), dtype=np.int64)
+    for row, generator, count in zip(rows, rng.generators, counts):
+        row[:count] = generator.integers(low, high, count)
+    return rows
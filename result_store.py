@@ -0,0 +1,196 @@
+""" Result Store
+
+Content-addressed cache of model runs. Each run is stored under a hash of
+the engine, the constructor parameters, the seed, max_steps, a fingerprint
+of any shared population the run was given and a fingerprint of the source
+files the engine runs, next to a JSON file
+recording exactly what produced it. A stored run is returned instantly;
+changing the parameters or the code gives a new key, so the run is
+computed again.
+
+Rebuilding a figure:
+    store = ResultStore("results")
+    one_scattered = store.reference_sweep({"threshold": "One-scattered"},
+                                          seeds=range(1000))
+"""
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+import ensemble_model as em
+import headless_runner as hr
+import shared_population as sp
+
+# Source files each engine runs
+ENGINE_FILES = {
+    "reference": ["model.py", "banking_model_functions.py", "threshold_model_functions.py",
+                  "loan_market.py", "loan_book.py", "network_topology.py",
+                  "population_scaling.py", "withdrawal_engine.py", "random_streams.py",
+                  "neighbor_kernels.py", "neighbor_kernels_numba.py"],
+    "ensemble": ["ensemble_model.py", "ensemble_functions.py", "headless_runner.py",
+                 "loan_market.py", "network_topology.py", "population_scaling.py",
+                 "withdrawal_engine.py", "random_streams.py", "neighbor_kernels.py",
+                 "neighbor_kernels_numba.py"]}
+
+# Constructor arguments that are not model parameters, by engine
+RUN_ARGUMENTS = {"reference": (), "ensemble": ("num_replicates", "seed", "population")}
+
+# Fingerprints already computed by this process, by engine
+fingerprints = {}
+
+# Fingerprints of shared populations already computed by this process, by directory
+population_fingerprints = {}
+
+
+def code_fingerprint(engine):
+    """ Hash of the source files an engine runs """
+    if engine not in fingerprints:
+        code = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in ENGINE_FILES[engine]:
+            code.update(name.encode())
+            with open(os.path.join(directory, name), "rb") as source:
+                code.update(source.read())
+        fingerprints[engine] = code.hexdigest()
+    return fingerprints[engine]
+
+
+def population_fingerprint(population):
+    """
+    Hash of the arrays of a SharedPopulation, or the fingerprint itself when
+    given one, as recorded in a stored description
+    """
+    if isinstance(population, str):
+        return population
+    if population.directory not in population_fingerprints:
+        arrays = hashlib.sha256()
+        for name in sp.POPULATION_ARRAYS:
+            arrays.update(name.encode())
+            with open(os.path.join(population.directory, name + ".npy"), "rb") as saved:
+                arrays.update(saved.read())
+        population_fingerprints[population.directory] = arrays.hexdigest()
+    return population_fingerprints[population.directory]
+
+
+def engine_defaults(engine):
+    """ Default value of every parameter of an engine's constructor """
+    if engine == "reference":
+        from model import BankRunModel as constructor
+    else:
+        constructor = em.BankRunEnsemble
+    return {name: parameter.default
+            for name, parameter in inspect.signature(constructor).parameters.items()
+            if parameter.default is not inspect.Parameter.empty
+            and name not in RUN_ARGUMENTS[engine]}
+
+
+def normalize(engine, parameters):
+    """
+    Parameters without the values equal to the engine's defaults, so runs
+    that differ only in which defaults were spelled out share a key
+    """
+    defaults = engine_defaults(engine)
+    return {name: value for name, value in parameters.items()
+            if name not in defaults or value != defaults[name]}
+
+
+def describe(engine, parameters, seed, max_steps, population=None, **options):
+    """
+    Everything that determines the results of a run
+    A shared population is described by its fingerprint, so runs on
+    different populations get different keys
+    """
+    if population is not None:
+        options["population"] = population_fingerprint(population)
+    return {"engine": engine, "parameters": normalize(engine, parameters), "seed": seed,
+            "max_steps": max_steps, "options": options, "code": code_fingerprint(engine)}
+
+
+def run_key(description):
+    """ Content address of a run """
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class ResultStore:
+    """
+    Runs stored in a directory, one data file and one description per run
+    Reference runs are stored as CSV files of the collected model data and
+    ensemble runs as .npz files of RunResults
+    """
+
+    def __init__(self, directory="results"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, extension):
+        """ Path of a stored file """
+        return os.path.join(self.directory, key + extension)
+
+    def get(self, engine, parameters, seed, max_steps, **options):
+        """ Returns a stored run, or None when it has not been stored """
+        key = run_key(describe(engine, parameters, seed, max_steps, **options))
+        if engine == "reference" and os.path.exists(self.path(key, ".csv")):
+            import pandas as pd
+
+            return pd.read_csv(self.path(key, ".csv"), float_precision="round_trip")
+        if engine == "ensemble" and os.path.exists(self.path(key, ".npz")):
+            with np.load(self.path(key, ".npz")) as saved:
+                model_vars = {name: saved[name] for name in saved.files}
+            return hr.RunResults(parameters, model_vars)
+        return None
+
+    def put(self, results, engine, parameters, seed, max_steps, **options):
+        """ Stores a run with its description """
+        description = describe(engine, parameters, seed, max_steps, **options)
+        key = run_key(description)
+        # Data is written before the description, so a described run is complete
+        if engine == "reference":
+            results.to_csv(self.path(key, ".csv.tmp"), index=False)
+            os.replace(self.path(key, ".csv.tmp"), self.path(key, ".csv"))
+        else:
+            with open(self.path(key, ".npz.tmp"), "wb") as data:
+                np.savez_compressed(data, **results.model_vars)
+            os.replace(self.path(key, ".npz.tmp"), self.path(key, ".npz"))
+        with open(self.path(key, ".json"), "w") as described:
+            json.dump(description, described, indent=1)
+        return key
+
+    def reference_run(self, parameters, seed, max_steps=119):
+        """ One seeded run of BankRunModel, from the store when possible """
+        results = self.get("reference", parameters, seed, max_steps)
+        if results is None:
+            import golden_runs
+
+            results = golden_runs.reference_engine(parameters, seed, max_steps)
+            results = results.reset_index(drop=True)
+            self.put(results, "reference", parameters, seed, max_steps)
+        return results
+
+    def reference_sweep(self, parameters, seeds, max_steps=119):
+        """
+        Seeded runs of every parameter combination, laid out like the
+        output of mesa.batch_run with one iteration per seed
+        """
+        import pandas as pd
+
+        frames = []
+        for combination in hr.parameter_grid(parameters):
+            for iteration, seed in enumerate(seeds):
+                results = self.reference_run(combination, seed, max_steps)
+                results.insert(0, "Step", np.arange(len(results)))
+                results.insert(0, "iteration", iteration)
+                results.insert(0, "RunId", len(frames))
+                for count, (name, value) in enumerate(combination.items()):
+                    results.insert(3 + count, name, value)
+                frames.append(results)
+        return pd.concat(frames, ignore_index=True)
+
+    def entries(self):
+        """ Descriptions of every stored run, by key """
+        entries = {}
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as described:
+                    entries[name[:-len(".json")]] = json.load(described)
+        return entries
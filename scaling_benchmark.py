@@ -0,0 +1,103 @@
+""" Scaling Benchmark
+
+Times the ensemble engine, and optionally the reference model, as the
+number of households grows. Savers and equity capital grow with the
+population so every size is the same economy at a different scale.
+
+Command line use:
+    python scaling_benchmark.py --sizes 1000 10000 100000 1000000 --max-steps 12
+"""
+import argparse
+import random
+import time
+import numpy as np
+import ensemble_model as em
+
+
+def scaled_parameters(num_households, **parameters):
+    """ Parameters of the default model scaled from 1000 households """
+    scaled = {"num_households": num_households,
+              "num_savers": num_households // 10,
+              "equity_capital": num_households}
+    scaled.update(parameters)
+    return scaled
+
+
+def time_ensemble(parameters, max_steps, num_replicates=1, seed=0):
+    """ Seconds taken to set up and to run the ensemble engine """
+    start = time.perf_counter()
+    ensemble = em.BankRunEnsemble(num_replicates=num_replicates, seed=seed, **parameters)
+    ensemble.step()
+    setup = time.perf_counter()
+    ensemble.run(max_steps)
+    return setup - start, time.perf_counter() - setup, ensemble
+
+
+def time_reference(parameters, max_steps, seed=0):
+    """ Seconds taken to set up and to run the reference model """
+    from model import BankRunModel
+
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    model = BankRunModel(**parameters)
+    model.step()
+    setup = time.perf_counter()
+    for _ in range(max_steps):
+        model.step()
+    return setup - start, time.perf_counter() - setup, model
+
+
+def run_benchmark(sizes, max_steps=12, num_replicates=1, reference_limit=0, **parameters):
+    """
+    Times both engines at every size; the reference model only runs up to
+    reference_limit households
+    Returns one row per engine and size
+    """
+    rows = []
+    for num_households in sizes:
+        scaled = scaled_parameters(num_households, **parameters)
+        setup, months, ensemble = time_ensemble(scaled, max_steps, num_replicates)
+        rows.append({"engine": "ensemble", "num_households": num_households,
+                     "space_size": ensemble.space_size,
+                     "n_of_innovators": ensemble.n_of_innovators,
+                     "setup_seconds": setup, "month_seconds": months / max(max_steps, 1),
+                     "household_months_per_second":
+                         num_households * num_replicates * max_steps / months if months else 0,
+                     "liquidity_event_rate": float(ensemble.liquidity_event.mean()),
+                     "adopters_percent": float(ensemble.adopters_percent.mean())})
+        if num_households <= reference_limit:
+            setup, months, model = time_reference(scaled, max_steps)
+            rows.append({"engine": "reference", "num_households": num_households,
+                         "space_size": model.space_size,
+                         "n_of_innovators": model.n_of_innovators,
+                         "setup_seconds": setup, "month_seconds": months / max(max_steps, 1),
+                         "household_months_per_second":
+                             num_households * max_steps / months if months else 0,
+                         "liquidity_event_rate": float(model.liquidity_event),
+                         "adopters_percent": float(model.adopters_percent)})
+    return rows
+
+
+def main():
+    """ Runs the benchmark from the command line and prints a table """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--max-steps", type=int, default=12)
+    parser.add_argument("--replicates", type=int, default=1)
+    parser.add_argument("--reference-limit", type=int, default=10000,
+                        help="Largest population to time the reference model at")
+    parser.add_argument("--threshold", default="One-scattered")
+    arguments = parser.parse_args()
+
+    rows = run_benchmark(arguments.sizes, arguments.max_steps, arguments.replicates,
+                         arguments.reference_limit, threshold=arguments.threshold)
+    columns = list(rows[0])
+    print("  ".join(f"{column:>14.14}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{value:>14.4g}" if isinstance(value, float) else f"{value:>14}"
+                        for value in row.values()))
+
+
+if __name__ == "__main__":
+    main()
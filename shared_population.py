@@ -0,0 +1,89 @@
+""" Shared Population
+
+Precomputed initial conditions - positions, budgets, savers and social
+circles - that many iterations can share. The arrays are written once to
+memory-mapped .npy files. Worker processes map them read-only without
+copying, and each run copies only the state it goes on to change.
+"""
+import inspect
+import os
+import shutil
+import tempfile
+import numpy as np
+import ensemble_model as em
+import ensemble_functions as ef
+import neighbor_kernels as nk
+
+POPULATION_ARRAYS = ("pos", "budget", "savers", "indptr", "indices", "far")
+
+# Parameters a population is drawn with, which every run sharing it must use
+POPULATION_PARAMETERS = ("num_households", "num_savers", "social_reach", "network_topology")
+
+# Populations already mapped by this process, by directory
+attached_populations = {}
+
+
+def make_population(num_households=1000, num_savers=100, social_reach=30, seed=None):
+    """ Draws one population the way the ensemble engine draws a replicate """
+    ensemble = em.BankRunEnsemble(num_replicates=1, seed=seed, num_households=num_households,
+                                  num_savers=num_savers, social_reach=social_reach)
+    ef.allocate_budget(ensemble)
+    ef.determine_savers(ensemble)
+    indptr, indices, far = nk.radius_graph(
+        ensemble.pos[0], ensemble.space_size, social_reach)
+    return {"pos": ensemble.pos[0], "budget": ensemble.budget[0],
+            "savers": ensemble.own_total_savings[0] > 0,
+            "indptr": indptr, "indices": indices, "far": far,
+            "parameters": {"num_households": num_households, "num_savers": num_savers,
+                           "social_reach": social_reach, "network_topology": "radius"}}
+
+
+class SharedPopulation:
+    """
+    A population written to memory-mapped files
+    Pass directory to workers and have them call attach(directory)
+    """
+
+    def __init__(self, population, directory=None):
+        self.owner = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="bank_run_population_")
+        self.directory = directory
+        self.parameters = {name: population["parameters"][name] for name in POPULATION_PARAMETERS}
+        for name in POPULATION_ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"),
+                    np.ascontiguousarray(population[name]))
+
+    def check(self, parameters):
+        """
+        Raises ValueError unless parameters, with the ensemble's defaults for
+        those left out, match the parameters the population was drawn with
+        """
+        defaults = {name: parameter.default for name, parameter in
+                    inspect.signature(em.BankRunEnsemble).parameters.items()}
+        for name, value in self.parameters.items():
+            used = parameters.get(name, defaults[name])
+            if used != value:
+                raise ValueError(f"Shared population was drawn with {name}={value!r}, "
+                                 f"but a run uses {name}={used!r}")
+
+    def close(self):
+        """ Removes the files if this object created them """
+        attached_populations.pop(self.directory, None)
+        if self.owner:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach(directory):
+    """ Maps a shared population read-only, once per process """
+    if directory not in attached_populations:
+        attached_populations[directory] = {
+            name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+            for name in POPULATION_ARRAYS}
+    return attached_populations[directory]
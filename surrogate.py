@@ -0,0 +1,343 @@
+""" Surrogate
+
+Gaussian-process emulator of sweep results, for answering scenario
+questions without running the model. Each parameter combination of a sweep
+is summarized by its number of liquidity events and replicates and the mean
+month of its liquidity events. One Gaussian process is fitted to the logit
+of the event probability and one to the event month, with noise set by how
+many replicates each summary rests on. Predictions come with a standard
+deviation, and queries outside the parameters the emulator was trained on
+are flagged so they can be sent to a real run instead.
+
+Notebook use:
+    results = headless_runner.batch_run({"social_reach": [10, 30, 50],
+                                         "threshold": ["One-scattered", "One-clustered"]},
+                                        iterations=1000, seed=1)
+    emulator = Surrogate().fit(sweep_summaries(results))
+    emulator.predict({"social_reach": 40, "threshold": "One-clustered"})
+
+Command line use:
+    python surrogate.py results.npz --query '{"social_reach": 40}'
+"""
+import argparse
+import json
+import math
+import numpy as np
+
+# Length scales tried when fitting, in units of the trained range of each parameter
+LENGTH_SCALES = (0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5)
+
+
+def summarize(parameters, liquidity_event, liquidity_event_month):
+    """ Summary of the final values of the replicates of one parameter combination """
+    liquidity_event = np.asarray(liquidity_event) > 0
+    months = np.asarray(liquidity_event_month, dtype=float)[liquidity_event]
+    return {"parameters": dict(parameters),
+            "events": int(liquidity_event.sum()),
+            "runs": int(len(liquidity_event)),
+            "event_month": float(months.mean()) if len(months) else math.nan,
+            "event_month_variance": float(months.var(ddof=1)) if len(months) > 1 else math.nan}
+
+
+def sweep_summaries(results):
+    """ Summaries of the RunResults of a sweep, one per parameter combination """
+    return [summarize(result.parameters, result.final("liquidity_event"),
+                      result.final("liquidity_event_month")) for result in results]
+
+
+def dataframe_summaries(frame, parameters):
+    """
+    Summaries of a sweep laid out like the output of mesa.batch_run, using
+    the last step of every run; parameters names the swept columns
+    """
+    final = frame.sort_values("Step").groupby("RunId").tail(1)
+    return [summarize(dict(zip(parameters, values if isinstance(values, tuple) else (values,))),
+                      group["liquidity_event"], group["liquidity_event_month"])
+            for values, group in final.groupby(list(parameters))]
+
+
+def store_summaries(store, engine="ensemble"):
+    """
+    Summaries of every run of an engine kept in a ResultStore, with the
+    engine's defaults filled in for parameters the store leaves out
+    """
+    import result_store
+
+    defaults = result_store.engine_defaults(engine)
+    summaries = []
+    for description in store.entries().values():
+        if description["engine"] != engine:
+            continue
+        results = store.get(engine, description["parameters"], description["seed"],
+                            description["max_steps"], **description["options"])
+        if results is None:
+            continue
+        parameters = dict(defaults, **description["parameters"])
+        if engine == "ensemble":
+            summaries.append(summarize(parameters,
+                                       results.final("liquidity_event"),
+                                       results.final("liquidity_event_month")))
+        else:
+            final = results.iloc[-1]
+            summaries.append(summarize(parameters, [final["liquidity_event"]],
+                                       [final["liquidity_event_month"]]))
+    return summaries
+
+
+def merge_summaries(summaries):
+    """ Pools summaries of the same parameters, such as runs with different seeds """
+    pooled = {}
+    for summary in summaries:
+        key = json.dumps(summary["parameters"], sort_keys=True)
+        totals = pooled.setdefault(key, {"parameters": summary["parameters"], "events": 0,
+                                         "runs": 0, "months": 0.0, "squares": 0.0})
+        events = summary["events"]
+        totals["events"] += events
+        totals["runs"] += summary["runs"]
+        if events:
+            variance = summary["event_month_variance"] if events > 1 else 0.0
+            totals["months"] += events * summary["event_month"]
+            totals["squares"] += (events - 1) * variance + events * summary["event_month"] ** 2
+
+    merged = []
+    for totals in pooled.values():
+        events = totals["events"]
+        merged.append({"parameters": totals["parameters"], "events": events,
+                       "runs": totals["runs"],
+                       "event_month": totals["months"] / events if events else math.nan,
+                       "event_month_variance":
+                           (totals["squares"] - totals["months"] ** 2 / events) / (events - 1)
+                           if events > 1 else math.nan})
+    return merged
+
+
+def nearest_distances(inputs, trained, exclude_self=False):
+    """
+    Distance from each scaled input to the nearest trained input
+    exclude_self skips each trained input's distance to itself
+    """
+    distances = np.sqrt(((inputs[:, None, :] - trained[None, :, :]) ** 2).sum(axis=2))
+    if exclude_self:
+        distances[np.diag_indices_from(distances)] = math.inf
+    return distances.min(axis=1, initial=math.inf)
+
+
+def expit(logit):
+    """ Probability of a logit """
+    return 1 / (1 + np.exp(-logit))
+
+
+class GaussianProcess:
+    """
+    Gaussian-process regression with a squared exponential kernel and known
+    noise variance for every training point
+    Inputs are scaled to the unit cube; the length scale and signal variance
+    are chosen by marginal likelihood
+    """
+
+    def fit(self, inputs, targets, noise):
+        """ Fits the process to targets observed with the given noise variances """
+        self.inputs = np.asarray(inputs, dtype=float)
+        targets = np.asarray(targets, dtype=float)
+        noise = np.asarray(noise, dtype=float)
+        self.mean = targets.mean()
+        centred = targets - self.mean
+        spread = max(centred.var(), 1e-6)
+
+        best = None
+        for length_scale in LENGTH_SCALES:
+            for signal_variance in (0.25 * spread, spread, 4 * spread):
+                fitted = self.solve(length_scale, signal_variance, centred, noise)
+                if fitted is not None and (best is None or fitted[0] > best[0]):
+                    best = fitted + (length_scale, signal_variance)
+        _, self.cholesky, self.weights, self.length_scale, self.signal_variance = best
+        return self
+
+    def kernel(self, first, second, length_scale, signal_variance):
+        """ Covariance between two sets of scaled inputs """
+        distances = ((first[:, None, :] - second[None, :, :]) ** 2).sum(axis=2)
+        return signal_variance * np.exp(-0.5 * distances / length_scale ** 2)
+
+    def solve(self, length_scale, signal_variance, centred, noise):
+        """ Log marginal likelihood, Cholesky factor and weights, or None if singular """
+        covariance = self.kernel(self.inputs, self.inputs, length_scale, signal_variance)
+        covariance[np.diag_indices_from(covariance)] += noise + 1e-9 * signal_variance
+        try:
+            cholesky = np.linalg.cholesky(covariance)
+        except np.linalg.LinAlgError:
+            return None
+        weights = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, centred))
+        likelihood = (-0.5 * centred @ weights - np.log(np.diag(cholesky)).sum()
+                      - 0.5 * len(centred) * math.log(2 * math.pi))
+        return likelihood, cholesky, weights
+
+    def predict(self, inputs):
+        """ Predictive mean and standard deviation at scaled inputs """
+        inputs = np.asarray(inputs, dtype=float)
+        cross = self.kernel(inputs, self.inputs, self.length_scale, self.signal_variance)
+        mean = self.mean + cross @ self.weights
+        solved = np.linalg.solve(self.cholesky, cross.T)
+        variance = np.maximum(self.signal_variance - (solved ** 2).sum(axis=0), 0)
+        return mean, np.sqrt(variance)
+
+
+class Surrogate:
+    """
+    Emulator of liquidity event probability and timing over the parameters
+    of a sweep
+    Numeric parameters are scaled to their trained range; any other
+    parameter is one-hot encoded
+    A query is outside the trained region when a numeric parameter is
+    outside its trained range, a category was never trained on, or its
+    scaled distance to the nearest trained point is above
+    max_relative_distance of the largest distance from a trained point to
+    its nearest neighbour; noisy or saturated trained points widen the
+    interval but do not move a query out of the trained region
+    """
+
+    def __init__(self, max_relative_distance=1.0):
+        self.max_relative_distance = max_relative_distance
+
+    def fit(self, summaries):
+        """ Fits the emulator to sweep summaries and returns it """
+        summaries = [summary for summary in merge_summaries(summaries) if summary["runs"] > 0]
+        if not summaries:
+            raise ValueError("The surrogate needs at least one summary with runs")
+        names = sorted({name for summary in summaries for name in summary["parameters"]})
+        self.numeric = {}
+        self.categories = {}
+        self.fixed = {}
+        for name in names:
+            values = [summary["parameters"].get(name) for summary in summaries]
+            if all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                   for value in values):
+                low, high = min(values), max(values)
+                if low == high:
+                    self.fixed[name] = low
+                else:
+                    self.numeric[name] = (low, high)
+            else:
+                categories = sorted({json.dumps(value) for value in values})
+                if len(categories) == 1:
+                    self.fixed[name] = values[0]
+                else:
+                    self.categories[name] = categories
+
+        inputs = self.encode([summary["parameters"] for summary in summaries])
+        self.inputs = inputs
+        # Spacing of the trained points, the largest distance to a nearest neighbour
+        distances = nearest_distances(inputs, inputs, exclude_self=True)
+        self.spacing = distances.max() if len(inputs) > 1 else math.inf
+        events = np.array([summary["events"] for summary in summaries], dtype=float)
+        runs = np.array([summary["runs"] for summary in summaries], dtype=float)
+        # Logit of the smoothed proportion, with its delta-method variance
+        proportion = (events + 0.5) / (runs + 1)
+        self.probability = GaussianProcess().fit(
+            inputs, np.log(proportion / (1 - proportion)),
+            1 / ((runs + 1) * proportion * (1 - proportion)))
+
+        timed = [count for count, summary in enumerate(summaries) if summary["events"] > 0]
+        self.timing = None
+        if timed:
+            months = np.array([summaries[count]["event_month"] for count in timed])
+            variances = np.array([summaries[count]["event_month_variance"] for count in timed])
+            variances = np.where(np.isnan(variances), np.nanmean(variances)
+                                 if np.isfinite(variances).any() else 1.0, variances)
+            self.timing = GaussianProcess().fit(
+                inputs[timed], months, variances / events[timed])
+        return self
+
+    def encode(self, queries):
+        """ Scaled inputs of a list of parameter dictionaries """
+        columns = []
+        for name, (low, high) in self.numeric.items():
+            columns.append([(query.get(name, math.nan) - low) / (high - low)
+                            for query in queries])
+        for name, categories in self.categories.items():
+            for category in categories:
+                columns.append([float(json.dumps(query.get(name)) == category)
+                                for query in queries])
+        return np.array(columns, dtype=float).T.reshape(len(queries), len(columns))
+
+    def domain_problems(self, query):
+        """ Reasons a query is outside the trained region, if any """
+        problems = []
+        for name, value in query.items():
+            if name not in self.numeric and name not in self.categories and \
+                    name not in self.fixed:
+                problems.append(f"{name} was not varied or fixed in training")
+        for name, (low, high) in self.numeric.items():
+            value = query.get(name)
+            if value is None:
+                problems.append(f"{name} is missing")
+            elif not low <= value <= high:
+                problems.append(f"{name}={value} is outside the trained range {low} to {high}")
+        for name, categories in self.categories.items():
+            if json.dumps(query.get(name)) not in categories:
+                problems.append(f"{name}={query.get(name)!r} was not trained on")
+        for name, value in self.fixed.items():
+            if name in query and query[name] != value:
+                problems.append(f"{name} was fixed at {value!r} in training")
+        return problems
+
+    def predict(self, queries):
+        """
+        Predicts the liquidity event probability and mean event month of
+        one query, or a list of queries, of parameter values
+        Parameters held fixed in training may be left out
+        Returns a dictionary per query with each prediction, its standard
+        deviation, a 95% interval of the probability, and whether the
+        query is inside the trained region with the reasons if it is not
+        """
+        single = isinstance(queries, dict)
+        queries = [dict(self.fixed, **query) for query in ([queries] if single else queries)]
+        # Missing parameters are reported as problems and encoded at the low end
+        inputs = np.nan_to_num(self.encode(queries))
+
+        logit, logit_sd = self.probability.predict(inputs)
+        probability = expit(logit)
+        low, high = expit(logit - 2 * logit_sd), expit(logit + 2 * logit_sd)
+        if self.timing is not None:
+            month, month_sd = self.timing.predict(inputs)
+        else:
+            month = month_sd = np.full(len(queries), math.nan)
+        distances = nearest_distances(inputs, self.inputs)
+
+        predictions = []
+        for count, query in enumerate(queries):
+            problems = self.domain_problems(query)
+            if distances[count] > self.max_relative_distance * self.spacing:
+                problems.append("too far from the trained points")
+            predictions.append({
+                "probability": float(probability[count]),
+                "probability_sd": float(probability[count] * (1 - probability[count]) *
+                                        logit_sd[count]),
+                "probability_interval": [float(low[count]), float(high[count])],
+                "event_month": float(month[count]),
+                "event_month_sd": float(month_sd[count]),
+                "in_domain": not problems,
+                "problems": problems})
+        return predictions[0] if single else predictions
+
+
+def main():
+    """ Fits the emulator to saved sweep results and answers queries """
+    import headless_runner as hr
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("results", nargs="+", help=".npz files written by headless_runner.py")
+    parser.add_argument("--query", action="append", required=True,
+                        help="JSON object of parameter values; may be repeated")
+    arguments = parser.parse_args()
+
+    summaries = []
+    for path in arguments.results:
+        summaries += sweep_summaries(hr.load_results(path))
+    emulator = Surrogate().fit(summaries)
+    for query in arguments.query:
+        print(json.dumps({"query": json.loads(query),
+                          "prediction": emulator.predict(json.loads(query))}))
+
+
+if __name__ == "__main__":
+    main()
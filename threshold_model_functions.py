@@ -1,17 +1,22 @@
 """ Threshold Model Functions """
-from statistics import mean, median
-import random
+from statistics import mean
 import numpy as np
+import neighbor_kernels as nk
+import network_topology as nt
+import population_scaling as ps
+import random_streams as rs
 
 
 def create_circles(model):
     """ Create social circles """
-    circle_sizes = []
-    for household in model.households:
-        neighbors = household.model.space.get_neighbors(
-            household.pos, household.model.social_reach, False)
-        household.n_of_my_circle = len(neighbors)
-        circle_sizes.append(household.n_of_my_circle)
+    # Only graphs built from positions change when households shift
+    if model.circles is None or model.network_topology in nt.SPATIAL_TOPOLOGIES:
+        model.circles = nt.make_graph(
+            model, [household.pos for household in model.households],
+            rs.numpy_stream(model, "network"))
+    circle_sizes = nk.circle_sizes(model.circles).tolist()
+    for household, n_of_my_circle in zip(model.households, circle_sizes):
+        household.n_of_my_circle = n_of_my_circle
 
     model.min_circle_size = 0
     model.av_circle_size = 0
@@ -37,7 +42,7 @@ def initialize_thresholds_and_innovators(model):
             if household.n_of_my_circle > 0:
                 household.my_threshold = 1
         # Select innovators
-        innovators = random.sample(
+        innovators = rs.python_stream(model, "innovators").sample(
             model.households, model.n_of_innovators)
         for innovator in innovators:
             innovator.adopt()
@@ -49,7 +54,7 @@ def initialize_thresholds_and_innovators(model):
             if household.n_of_my_circle > 0:
                 household.my_threshold = 1
         # Select innovators to seed process
-        innovators = random.sample(model.households, 1)
+        innovators = rs.python_stream(model, "innovators").sample(model.households, 1)
         for innovator in innovators:
             innovator.adopt()
             innovator.status = "Innovator"
@@ -60,7 +65,8 @@ def initialize_thresholds_and_innovators(model):
             surplus = model.count_of_innovators - model.n_of_innovators
             potential_unadopters = [
                 household for household in model.households if household.status == "Innovator"]
-            unadopters = random.sample(potential_unadopters, surplus)
+            unadopters = rs.python_stream(model, "innovators").sample(
+                potential_unadopters, surplus)
             for unadopter in unadopters:
                 unadopter.status = 0
                 unadopter.adoption = "no"
@@ -69,8 +75,10 @@ def initialize_thresholds_and_innovators(model):
 
     if model.threshold == "Heterogeneous-uniform":
         # Give everyone a social threshold from 1 to 100 distributed evenly
-        for household in model.households:
-            household.my_threshold = 1 + random.randint(0, 98)
+        # Drawn for every household at once, scaling uniform draws, which
+        # np.random and NumPy generators both provide
+        set_thresholds(model, 1 + np.floor(rs.numpy_stream(model, "thresholds").random(
+            model.num_households) * 99).astype(int))
         record_heterogeneous_thresholds(model)
         select_innovators(model)
 
@@ -78,13 +86,10 @@ def initialize_thresholds_and_innovators(model):
         # Give everyone a social threshold distributed normally with mean as set
         # by modeler and sd equal to the mean with adjustments to ensure values
         # lie between 0 and 100
-        for household in model.households:
-            household.my_threshold = round(
-                1 + np.random.normal(model.mean_threshold, model.mean_threshold))
-            if household.my_threshold < 0:
-                household.my_threshold = model.mean_threshold
-            if household.my_threshold > 100:
-                household.my_threshold = model.mean_threshold
+        my_thresholds = np.round(1 + rs.numpy_stream(model, "thresholds").normal(
+            model.mean_threshold, model.mean_threshold, size=model.num_households)).astype(int)
+        set_thresholds(model, np.where((my_thresholds < 0) | (my_thresholds > 100),
+                                       model.mean_threshold, my_thresholds))
         record_heterogeneous_thresholds(model)
         select_innovators(model)
 
@@ -101,8 +106,13 @@ def grow_network_of_innovators(model):
             household for household in model.households if household.adoption == "yes"]
         for adopter in adopters:
             # Get neighbors
-            neighbors = adopter.model.space.get_neighbors(
-                adopter.pos, adopter.model.social_reach + 10, False)
+            if model.network_topology == "radius":
+                neighbors = adopter.model.space.get_neighbors(
+                    adopter.pos, adopter.model.social_reach + 10, False)
+            else:
+                indptr, indices, _ = model.circles
+                neighbors = [model.households[index] for index in
+                             indices[indptr[adopter.unique_id]:indptr[adopter.unique_id + 1]]]
             adopter.my_circle_non_adopters = [
                 neighbor for neighbor in neighbors if neighbor.adoption == "no"]
             if len(adopter.my_circle_non_adopters) > 0:
@@ -113,7 +123,7 @@ def grow_network_of_innovators(model):
                 # no-one left in network, re-seed
                 nonadopters = [
                     household for household in model.households if household.adoption == "no"]
-                innovators = random.sample(nonadopters, 1)
+                innovators = rs.python_stream(model, "spread").sample(nonadopters, 1)
                 for innovator in innovators:
                     innovator.adopt()
                     innovator.status = "Innovator"
@@ -122,27 +132,45 @@ def grow_network_of_innovators(model):
         model.count_of_innovators = len(adopters)
 
 
+def set_thresholds(model, my_thresholds):
+    """ Gives each household its threshold and keeps the thresholds as an array """
+    model.my_thresholds = my_thresholds
+    for household, my_threshold in zip(model.households, my_thresholds.tolist()):
+        household.my_threshold = my_threshold
+
+
 def record_heterogeneous_thresholds(model):
     """ Records heterogeneous thresholds """
     model.het = "yes"
 
-    thresholds = []
-    for household in model.households:
-        thresholds.append(household.my_threshold)
+    model.min_my_threshold = model.my_thresholds.min().item()
+    model.median_my_threshold = np.median(model.my_thresholds).item()
+    model.mean_my_threshold = model.my_thresholds.mean().item()
+    model.max_my_threshold = model.my_thresholds.max().item()
 
-    model.min_my_threshold = min(thresholds)
-    model.median_my_threshold = median(thresholds)
-    model.mean_my_threshold = mean(thresholds)
-    model.max_my_threshold = max(thresholds)
+
+def lowest_thresholds(my_thresholds, count):
+    """
+    Marks the count households with the lowest thresholds, taking ties in
+    household order as a stable sort would, by partial selection instead
+    of sorting every threshold
+    """
+    count = min(count, len(my_thresholds))
+    if count == 0:
+        return np.zeros(len(my_thresholds), dtype=bool)
+    cut_off = np.partition(my_thresholds, count - 1)[count - 1]
+    below = my_thresholds < cut_off
+    ties = my_thresholds == cut_off
+    return below | (ties & (np.cumsum(ties) <= count - below.sum()))
 
 
 def select_innovators(model):
     """ Selects innovators """
-    model.households_listed_by_threshold = model.households.copy()
-    model.households_listed_by_threshold.sort(key=lambda x: x.my_threshold)
+    innovators = np.flatnonzero(lowest_thresholds(model.my_thresholds, model.n_of_innovators))
+    innovators = innovators[np.argsort(model.my_thresholds[innovators], kind="stable")]
+    model.households_listed_by_threshold = [model.households[index] for index in innovators]
     model.count_of_innovators = 0
-    for _ in range(model.n_of_innovators):
-        household = model.households_listed_by_threshold[model.count_of_innovators]
+    for household in model.households_listed_by_threshold:
         household.adopt()
         household.status = "Innovator"
         model.count_of_innovators += 1
@@ -152,15 +180,15 @@ def record_adoption_rate(model):
     """ Record the adoption rate """
     adopters = [
         household for household in model.households if household.adoption == "yes"]
-    model.adopters_percent = len(adopters) / 10
+    model.adopters_percent = len(adopters) / ps.households_per_percent(model.num_households)
     model.adoption_percent_record.append(model.adopters_percent)
 
 
 def shift(model):
     """ Social shifting """
-    model.n_of_shifters = model.social_shift_percent * 10
+    model.n_of_shifters = ps.count_of_percent(model.social_shift_percent, model.num_households)
 
-    shifters = random.sample(
+    shifters = rs.python_stream(model, "shift").sample(
         model.households, model.n_of_shifters)
 
     for shifter in shifters:
@@ -190,19 +218,28 @@ def spread(model):
     record_adoption_rate(model)
 
 
+def count_adopting_friends(model, include_center):
+    """
+    Counts the adopters within social reach of each household
+    include_center also counts adopters at exactly the same position
+    """
+    adopted = [household.adoption == "yes" for household in model.households]
+    return nk.count_neighbors(model.circles, adopted, include_center)
+
+
 def spread_by_infection(model):
     """
     If any adopters in circle of non-adopters, non-adopters adopt
     Need to do this in two stages to avoid double-counting
     """
-    non_adopters = [household for household in model.households if household.adoption ==
-                    "no" and household.n_of_my_circle > 0]
-    for non_adopter in non_adopters:
-        neighbors = non_adopter.model.space.get_neighbors(
-            non_adopter.pos, non_adopter.model.social_reach, False)
-        adopting_neigbors = [
-            neighbor for neighbor in neighbors if neighbor.adoption == "yes"]
-        non_adopter.n_of_adopting_friends = len(adopting_neigbors)
+    non_adopters = [index for index, household in enumerate(model.households)
+                    if household.adoption == "no" and household.n_of_my_circle > 0]
+    if len(non_adopters) == 0:
+        return
+    n_of_adopting_friends = count_adopting_friends(model, False)
+    for index in non_adopters:
+        non_adopter = model.households[index]
+        non_adopter.n_of_adopting_friends = int(n_of_adopting_friends[index])
         if non_adopter.n_of_adopting_friends >= 1:
             non_adopter.status = "new"
 
@@ -215,14 +252,14 @@ def spread_by_influence(model):
         non_adopter_with_no_circle.my_friends_adoption_percent = model.adopters_percent
 
     non_adopters_with_circle = [
-        household for household in model.households
+        index for index, household in enumerate(model.households)
         if household.adoption == "no" and household.n_of_my_circle > 0]
-    for non_adopter_with_circle in non_adopters_with_circle:
-        neighbors = non_adopter_with_circle.model.space.get_neighbors(
-            non_adopter_with_circle.pos, non_adopter_with_circle.model.social_reach, True)
-        adopting_neighbors = [
-            neighbor for neighbor in neighbors if neighbor.adoption == "yes"]
-        non_adopter_with_circle.n_of_adopting_friends = len(adopting_neighbors)
+    if len(non_adopters_with_circle) > 0:
+        n_of_adopting_friends = count_adopting_friends(model, True)
+    for index in non_adopters_with_circle:
+        non_adopter_with_circle = model.households[index]
+        non_adopter_with_circle.n_of_adopting_friends = int(
+            n_of_adopting_friends[index])
         non_adopter_with_circle.my_friends_adoption_percent = \
             round((non_adopter_with_circle.n_of_adopting_friends /
                   non_adopter_with_circle.n_of_my_circle)*100, 1)
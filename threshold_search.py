@@ -0,0 +1,150 @@
+""" Threshold Search
+
+Finds the value of one parameter at which the probability of a liquidity
+event crosses a target, 50% by default, by noisy bisection. Each point is
+estimated with batches of replicates from the ensemble engine, and more
+batches are run only while the estimate cannot be told apart from the
+target, so most replicates are spent near the tipping point. Batches are
+seeded by their number, so every point sees the same random streams, and
+with a ResultStore batches already run are reused. A logistic curve fitted
+to every point evaluated gives a smoothed estimate of the tipping point.
+
+Command line use:
+    python headless_runner.py --search social_reach 10 60 --max-steps 119
+        --parameters '{"threshold": "One-clustered"}' --output search.json
+"""
+import math
+import numpy as np
+import headless_runner as hr
+
+
+def run_batch(parameters, iterations, max_steps, seed, store=None, number_processes=1,
+              pool=None, block_size=100, population=None):
+    """ Runs one batch of replicates, or takes it from the store """
+    results = None
+    if store is not None:
+        results = store.get("ensemble", parameters, seed, max_steps, iterations=iterations,
+                            block_size=block_size, population=population)
+    if results is None:
+        results = hr.batch_run(parameters, iterations, max_steps, number_processes, seed,
+                               block_size, pool, population)[0]
+        if store is not None:
+            store.put(results, "ensemble", parameters, seed, max_steps, iterations=iterations,
+                      block_size=block_size, population=population)
+    return results
+
+
+def event_probability(parameters, max_steps=119, seed=0, target=0.5, z_score=2.0,
+                      batch_iterations=100, max_iterations=1000, **run_options):
+    """
+    Estimates the probability of a liquidity event
+    Batches of batch_iterations replicates are added, up to max_iterations,
+    while the estimate is within z_score standard errors of the target
+    Returns the number of liquidity events and the number of replicates
+    """
+    events = 0
+    runs = 0
+    batch = 0
+    while runs < max_iterations:
+        results = run_batch(parameters, batch_iterations, max_steps, [seed, batch],
+                            **run_options)
+        events += int(results.final("liquidity_event").sum())
+        runs += results.num_replicates
+        batch += 1
+        probability = events / runs
+        if abs(probability - target) > z_score * math.sqrt(probability * (1 - probability) / runs):
+            break
+    return events, runs
+
+
+def fit_tipping_point(values, events, runs, target=0.5):
+    """
+    Fits a logistic curve of event probability against the parameter by
+    maximum likelihood and returns where it crosses the target
+    Returns None when the fit does not cross the target within the values
+    """
+    values = np.asarray(values, dtype=float)
+    events = np.asarray(events, dtype=float)
+    runs = np.asarray(runs, dtype=float)
+    centre = values.mean()
+    design = np.column_stack([np.ones_like(values), values - centre])
+    coefficients = np.zeros(2)
+    for _ in range(100):
+        probability = 1 / (1 + np.exp(-design @ coefficients))
+        weights = runs * probability * (1 - probability)
+        hessian = design.T @ (design * weights[:, None]) + 1e-9 * np.eye(2)
+        step = np.linalg.solve(hessian, design.T @ (events - runs * probability))
+        coefficients += step
+        if np.abs(step).max() < 1e-10:
+            break
+    if coefficients[1] == 0 or not np.isfinite(coefficients).all():
+        return None
+    tipping_point = centre + (math.log(target / (1 - target)) - coefficients[0]) / coefficients[1]
+    if not values.min() <= tipping_point <= values.max():
+        return None
+    return float(tipping_point)
+
+
+def find_tipping_point(parameter, low, high, parameters=None, target=0.5, tolerance=1.0,
+                       integer=False, max_steps=119, seed=0, **estimate_options):
+    """
+    Bisects parameter between low and high for the value where the
+    probability of a liquidity event crosses target
+    parameters holds the other BankRunModel parameters; integer keeps the
+    values tried whole numbers
+    estimate_options are passed to event_probability, for example
+    batch_iterations, max_iterations, store or number_processes; with more
+    than one process and no pool, one pool is started for the whole search
+    Returns the bracket found, its midpoint, the fitted tipping point and
+    every point evaluated
+    """
+    parameters = dict(parameters or {})
+    new_pool = None
+    if estimate_options.get("pool") is None and estimate_options.get("number_processes", 1) > 1:
+        estimate_options["pool"] = new_pool = hr.make_pool(estimate_options["number_processes"])
+    try:
+        return bisect(parameter, low, high, parameters, target, tolerance, integer, max_steps,
+                      seed, estimate_options)
+    finally:
+        if new_pool is not None:
+            new_pool.terminate()
+
+
+def bisect(parameter, low, high, parameters, target, tolerance, integer, max_steps, seed,
+           estimate_options):
+    """ Runs the bisection of find_tipping_point """
+    evaluations = []
+
+    def evaluate(value):
+        events, runs = event_probability(dict(parameters, **{parameter: value}), max_steps,
+                                         seed, target, **estimate_options)
+        evaluations.append({"value": value, "events": events, "runs": runs,
+                            "probability": events / runs})
+        return events / runs >= target
+
+    low_above = evaluate(low)
+    if evaluate(high) == low_above:
+        raise ValueError(f"The liquidity event probability does not cross {target} "
+                         f"between {parameter}={low} and {parameter}={high}")
+
+    while high - low > tolerance:
+        middle = (low + high) / 2
+        if integer:
+            middle = int(middle)
+            if middle in (low, high):
+                break
+        if evaluate(middle) == low_above:
+            low = middle
+        else:
+            high = middle
+
+    return {"parameter": parameter,
+            "low": low,
+            "high": high,
+            "tipping_point": (low + high) / 2,
+            "fitted_tipping_point": fit_tipping_point(
+                [evaluation["value"] for evaluation in evaluations],
+                [evaluation["events"] for evaluation in evaluations],
+                [evaluation["runs"] for evaluation in evaluations], target),
+            "evaluations": evaluations,
+            "total_runs": sum(evaluation["runs"] for evaluation in evaluations)}
@@ -0,0 +1,80 @@
+""" Trajectory Recorder
+
+Opt-in recorder of per-household state for debugging contagion. Each month
+one row block of fixed-width household columns is written straight to a
+memory-mapped .npy file, so trajectories of large runs never have to be held
+in memory during the simulation. Closing the recorder trims the file to the
+months actually recorded.
+"""
+import os
+import warnings
+import numpy as np
+
+TRAJECTORY_DTYPE = np.dtype([("own_total_savings", "f8"),
+                             ("own_outstanding_borrowing", "f8"),
+                             ("adoption", "u1"),
+                             ("status", "i1")])
+
+# Household status as stored in the status column
+STATUS_CODES = {0: 0, "Innovator": 1, "new": 2}
+
+
+class TrajectoryRecorder:
+    """ Writes one row of household state per month to a memory-mapped file """
+
+    def __init__(self, path, num_households, max_months):
+        self.path = path
+        self.max_months = max_months
+        self.months_recorded = 0
+        self.overflowed = False
+        self.trajectories = np.lib.format.open_memmap(
+            path, mode="w+", dtype=TRAJECTORY_DTYPE, shape=(max_months, num_households))
+
+    def record(self, model):
+        """ Records the state of every household for the current month """
+        if self.trajectories is None or self.full():
+            if not self.overflowed:
+                warnings.warn(f"Trajectory file {self.path} holds {self.months_recorded} "
+                              "months and is closed; later months are not recorded",
+                              stacklevel=2)
+                self.overflowed = True
+            return
+        month = self.trajectories[self.months_recorded]
+        month["own_total_savings"] = [
+            household.own_total_savings for household in model.households]
+        month["own_outstanding_borrowing"] = [
+            household.own_outstanding_borrowing for household in model.households]
+        month["adoption"] = [
+            household.adoption == "yes" for household in model.households]
+        month["status"] = [
+            STATUS_CODES[household.status] for household in model.households]
+        self.months_recorded += 1
+
+    def full(self):
+        """ Whether every month the file holds has been recorded """
+        return self.months_recorded >= self.max_months
+
+    def close(self):
+        """
+        Flushes the recorded months to disk and, if fewer months than the
+        file holds were recorded, rewrites it with only those months
+        """
+        if self.trajectories is None:
+            return
+        self.trajectories.flush()
+        trimmed = self.months_recorded < len(self.trajectories)
+        self.trajectories = None
+        if trimmed:
+            recorded = np.load(self.path, mmap_mode="r")[:self.months_recorded]
+            np.save(self.path + ".tmp.npy", recorded)
+            del recorded
+            os.replace(self.path + ".tmp.npy", self.path)
+
+
+def load_trajectories(path):
+    """
+    Maps recorded trajectories read-only
+    Returns an array shaped (months, households) with one field per column;
+    a file closed by its recorder holds only the months recorded
+    """
+    return np.load(path, mmap_mode="r")
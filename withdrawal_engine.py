@@ -0,0 +1,63 @@
+""" Withdrawal Engine
+
+Withdrawals spread over the days of a month. Each adopter's withdrawal
+arrives at a random time within the month; withdrawals are sorted by
+arrival and their running total is compared with the bank's liquid assets,
+so the day and the household at which liquidity runs out are found from one
+cumulative sum instead of by simulating the month day by day. The liquid
+assets left at the end of each day are kept as a short float32 path.
+"""
+import numpy as np
+
+DAYS_PER_MONTH = 30
+
+
+def arrival_times(rng, shape):
+    """ Arrival time of each withdrawal, in days from the start of the month """
+    return rng.uniform(0, DAYS_PER_MONTH, shape)
+
+
+def drain(amounts, times, liquid_assets):
+    """
+    Pays withdrawals out of liquid_assets in order of arrival
+    Works on the withdrawals of one population, with one liquid_assets, or on
+    arrays shaped (replicates, households) with one liquid_assets per
+    replicate; withdrawals that never arrive have an infinite time
+    Liquidity is exhausted by the first withdrawal that leaves the liquid
+    assets below zero, rounded as in the monthly liquidity event check
+    Returns the position in amounts of that withdrawal, -1 when liquidity
+    lasts the month, its arrival time, nan when liquidity lasts, and the
+    liquid assets at the end of each day
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    rows = np.atleast_2d(amounts)
+    time_rows = np.asarray(times, dtype=float).reshape(rows.shape)
+    liquid = np.broadcast_to(np.asarray(liquid_assets, dtype=float), rows.shape[:1])
+    num_withdrawals = rows.shape[1]
+    # An empty withdrawal that never arrives ends every row
+    rows = np.pad(rows, ((0, 0), (0, 1)))
+    time_rows = np.pad(time_rows, ((0, 0), (0, 1)), constant_values=np.inf)
+
+    order = np.argsort(time_rows, axis=1, kind="stable")
+    sorted_times = np.take_along_axis(time_rows, order, axis=1)
+    withdrawn = np.cumsum(np.take_along_axis(rows, order, axis=1), axis=1)
+    remaining = np.concatenate([liquid[:, None], liquid[:, None] - withdrawn], axis=1)
+
+    # The running total only grows, so the first exhausted withdrawal is
+    # the first True of a monotone mask
+    exhausted = np.round(remaining[:, 1:], 1) < 0
+    first = exhausted.argmax(axis=1)[:, None]
+    position = np.take_along_axis(order, first, axis=1)[:, 0]
+    found = np.take_along_axis(exhausted, first, axis=1)[:, 0] & (position < num_withdrawals)
+    position = np.where(found, position, -1)
+    day = np.where(found, np.take_along_axis(sorted_times, first, axis=1)[:, 0], np.nan)
+
+    # Liquid assets after the withdrawals arriving by the end of each day
+    day_ends = np.arange(1, DAYS_PER_MONTH + 1)
+    arrived = np.array([np.searchsorted(row, day_ends, side="right") for row in sorted_times],
+                       dtype=int).reshape(len(rows), DAYS_PER_MONTH)
+    path = np.take_along_axis(remaining, arrived, axis=1).astype(np.float32)
+
+    if amounts.ndim < 2:
+        return int(position[0]), float(day[0]), path[0]
+    return position, day, path